@@ -3,10 +3,10 @@ import os
 from typing import Union
 
 from alembic import context
-from sqlalchemy import create_engine
 from sqlalchemy.engine import URL
 
-from app.config import get_db_url
+from app.config import get_db_url, get_safe_db_url
+from app.db.engine import create_sa_engine
 from app.db.models import Base
 
 config = context.config
@@ -17,21 +17,13 @@ if config.config_file_name is not None:
 target_metadata = Base.metadata
 
 
-def _render_safe_dsn(url: Union[URL, str]) -> str:
-    try:
-        return url.render_as_string(hide_password=True)
-    except AttributeError:
-        return str(url)
-
-
 def _log_connection_info() -> Union[URL, str]:
     url = get_db_url()
     user = os.getenv("POSTGRESQL_USER", "")
     host = os.getenv("POSTGRESQL_HOST", "")
     dbname = os.getenv("POSTGRESQL_DBNAME", "")
     print(f"[Alembic] ENV user={user} host={host} db={dbname}")
-    safe_url = _render_safe_dsn(url)
-    print(f"[Alembic] DSN: {safe_url}")
+    print(f"[Alembic] DSN: {get_safe_db_url()}")
     return url
 
 
@@ -50,7 +42,8 @@ def run_migrations_offline() -> None:
 
 def run_migrations_online() -> None:
     url = _log_connection_info()
-    connectable = create_engine(url, future=True, pool_pre_ping=True)
+    # тот же движок и настройки пула, что и у приложения
+    connectable = create_sa_engine(url)
 
     with connectable.connect() as connection:
         context.configure(connection=connection, target_metadata=target_metadata)
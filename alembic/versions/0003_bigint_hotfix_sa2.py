@@ -8,100 +8,279 @@ down_revision = "0002_telegram_id_bigint"
 branch_labels = None
 depends_on = None
 
+# дочерние таблицы крупнее этого порога конвертируем через новый столбец,
+# чтобы не переписывать таблицу под ACCESS EXCLUSIVE
+_SWAP_MIN_ROWS = 100_000
+_SWAP_MIN_BYTES = 32 * 1024 * 1024
+_BACKFILL_BATCH = 50_000
+# временный CHECK вместо NOT NULL: проверяется без ACCESS EXCLUSIVE
+_NN_CHECK_SUFFIX = "_bigint_nn"
+_NN_CHECK_LIKE = r"%\_bigint\_nn"
 
-def _col_is_bigint(conn, table: str, column: str) -> bool:
+
+def _column_types(conn) -> dict:
+    """(table, column) -> (data_type, not_null) для всей схемы одним запросом."""
     sql = """
-    select data_type = 'bigint'
+    select table_name, column_name, data_type, is_nullable = 'NO'
     from information_schema.columns
-    where table_schema = 'public' and table_name = %(t)s and column_name = %(c)s
+    where table_schema = 'public'
     """
-    return bool(conn.exec_driver_sql(sql, {"t": table, "c": column}).scalar())
+    return {(t, c): (dt, nn) for t, c, dt, nn in conn.exec_driver_sql(sql).fetchall()}
 
 
-def upgrade() -> None:
-    conn = op.get_bind()
-    insp = sa.inspect(conn)
-
-    # собрать FKs -> users(id)
-    fk_refs = []
-    schema = "public"
-    for tbl in insp.get_table_names(schema=schema):
-        for fk in insp.get_foreign_keys(tbl, schema=schema):
-            if fk.get("referred_table") == "users" and fk.get("referred_columns") == ["id"]:
-                fk_refs.append(
-                    {
-                        "table": tbl,
-                        "schema": schema,
-                        "name": fk.get("name"),
-                        "local_cols": fk["constrained_columns"],
-                        "referent_schema": fk.get("referred_schema"),
-                        "onupdate": fk.get("onupdate"),
-                        "ondelete": fk.get("ondelete"),
-                        "deferrable": fk.get("deferrable"),
-                        "initially": fk.get("initially"),
-                        "match": fk.get("match"),
-                        "options": fk.get("options") if isinstance(fk.get("options"), dict) else {},
-                    }
+def _is_large(conn, table: str) -> bool:
+    """Крупная ли таблица. Без ANALYZE reltuples = -1 (или 0), поэтому смотрим и размер."""
+    sql = (
+        "select reltuples, pg_relation_size(oid) from pg_class "
+        "where oid = %(t)s::regclass"
+    )
+    rows, size = conn.exec_driver_sql(sql, {"t": f"public.{table}"}).first()
+    return rows < 0 or rows >= _SWAP_MIN_ROWS or size >= _SWAP_MIN_BYTES
+
+
+def _backfill_bigint(conn, table: str, column: str) -> None:
+    """Новый BIGINT-столбец рядом со старым, заполненный пачками.
+
+    Идёт до снятия FK и повторяем: при повторном запуске столбец уже есть.
+    """
+    new_col = f"{column}_new"
+    op.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {new_col} bigint")
+
+    lo, hi = conn.exec_driver_sql(f"select min(id), max(id) from {table}").first()
+    if lo is not None:
+        # бэкфилл пачками, каждая пачка — отдельная транзакция
+        with op.get_context().autocommit_block():
+            for start in range(lo, hi + 1, _BACKFILL_BATCH):
+                conn.exec_driver_sql(
+                    f"update {table} set {new_col} = {column} "
+                    f"where id between %(lo)s and %(hi)s",
+                    {"lo": start, "hi": start + _BACKFILL_BATCH - 1},
                 )
 
-    # снять FKs
-    for fk in fk_refs:
-        if fk["name"]:
-            op.drop_constraint(
-                fk["name"],
-                table_name=fk["table"],
-                type_="foreignkey",
-                schema=fk["schema"],
-            )
 
-    # users.id -> BIGINT (если ещё не)
-    if not _col_is_bigint(conn, "users", "id"):
-        op.alter_column(
-            "users",
-            "id",
-            existing_type=sa.Integer(),
-            type_=sa.BigInteger(),
-            postgresql_using="id::bigint",
+def _swap_to_bigint(conn, table: str, column: str, not_null: bool) -> None:
+    """Меняет столбец на заполненный _backfill_bigint без перезаписи таблицы."""
+    new_col = f"{column}_new"
+    params = {"t": f"public.{table}", "c": column}
+    constraints = conn.exec_driver_sql(
+        """
+        select c.conname, pg_get_constraintdef(c.oid)
+        from pg_constraint c
+        join pg_attribute a on a.attrelid = c.conrelid and a.attnum = any(c.conkey)
+        where c.conrelid = %(t)s::regclass and c.contype in ('u', 'c')
+          and a.attname = %(c)s
+        """,
+        params,
+    ).fetchall()
+    indexes = conn.exec_driver_sql(
+        """
+        select distinct pg_get_indexdef(i.indexrelid)
+        from pg_index i
+        join pg_attribute a on a.attrelid = i.indrelid and a.attnum = any(i.indkey)
+        where i.indrelid = %(t)s::regclass and a.attname = %(c)s
+          and not exists (select 1 from pg_constraint k where k.conindid = i.indexrelid)
+        """,
+        params,
+    ).scalars().all()
+
+    # догоняем строки, изменённые во время бэкфилла, и меняем столбцы местами;
+    # блокировка не даёт записать строку с пустым {new_col} до DROP COLUMN.
+    # Сразу ACCESS EXCLUSIVE: повышение с более слабой под DDL ловит deadlock
+    op.execute(f"LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE")
+    op.execute(
+        f"UPDATE {table} SET {new_col} = {column} "
+        f"WHERE {new_col} IS DISTINCT FROM {column}"
+    )
+    op.execute(f"ALTER TABLE {table} DROP COLUMN {column}")
+    op.execute(f"ALTER TABLE {table} RENAME COLUMN {new_col} TO {column}")
+    if not_null:
+        # SET NOT NULL сканировал бы таблицу под ACCESS EXCLUSIVE; CHECK NOT VALID
+        # действует на новые строки сразу, а проверяется в _apply_not_null
+        op.execute(
+            f"ALTER TABLE {table} ADD CONSTRAINT {table}_{column}{_NN_CHECK_SUFFIX} "
+            f"CHECK ({column} IS NOT NULL) NOT VALID"
         )
+    for name, ddl in constraints:
+        op.execute(f"ALTER TABLE {table} ADD CONSTRAINT {name} {ddl}")
+    for ddl in indexes:
+        op.execute(ddl)
 
-    # дочерние столбцы -> BIGINT
+
+def _apply_not_null(conn) -> None:
+    """VALIDATE временных CHECK и SET NOT NULL без повторного скана.
+
+    Ищет CHECK по каталогу, так что после падения на этом шаге повторный
+    запуск доделает оставшиеся столбцы. Вызывается в autocommit-блоке.
+    """
+    pending = conn.exec_driver_sql(
+        """
+        select cl.relname, a.attname, c.conname
+        from pg_constraint c
+        join pg_class cl on cl.oid = c.conrelid
+        join pg_namespace ns on ns.oid = cl.relnamespace
+        join pg_attribute a on a.attrelid = c.conrelid and a.attnum = c.conkey[1]
+        where ns.nspname = 'public' and c.contype = 'c'
+          and c.conname like %(pattern)s
+        """,
+        {"pattern": _NN_CHECK_LIKE},
+    ).fetchall()
+    for table, column, name in pending:
+        # VALIDATE берёт SHARE UPDATE EXCLUSIVE и не мешает записи;
+        # SET NOT NULL при валидном CHECK (PG12+) обходится без скана
+        op.execute(f"ALTER TABLE {table} VALIDATE CONSTRAINT {name}")
+        op.execute(f"ALTER TABLE {table} ALTER COLUMN {column} SET NOT NULL")
+        op.execute(f"ALTER TABLE {table} DROP CONSTRAINT {name}")
+
+
+_FK_ACTIONS = {"r": "RESTRICT", "c": "CASCADE", "n": "SET NULL", "d": "SET DEFAULT"}
+_FK_MATCH = {"f": "FULL", "p": "PARTIAL"}
+
+
+def _users_fk_refs(conn) -> list:
+    sql = """
+    select c.conname, ns.nspname, cl.relname, a.attname,
+           c.confdeltype, c.confupdtype, c.confmatchtype,
+           c.condeferrable, c.condeferred
+    from pg_constraint c
+    join pg_class cl on cl.oid = c.conrelid
+    join pg_namespace ns on ns.oid = cl.relnamespace
+    join unnest(c.conkey) with ordinality k(attnum, ord) on true
+    join pg_attribute a on a.attrelid = c.conrelid and a.attnum = k.attnum
+    join pg_attribute ra on ra.attrelid = c.confrelid and ra.attnum = c.confkey[1]
+    where c.contype = 'f' and c.confrelid = 'public.users'::regclass
+      and array_length(c.confkey, 1) = 1 and ra.attname = 'id'
+    order by ns.nspname, cl.relname, c.conname, k.ord
+    """
+    refs: dict = {}
+    for name, schema, table, col, on_del, on_upd, match, deferrable, deferred in (
+        conn.exec_driver_sql(sql).fetchall()
+    ):
+        key = (schema, table, name)
+        fk = refs.get(key)
+        if fk is None:
+            fk = refs[key] = {
+                "table": table,
+                "schema": schema,
+                "name": name,
+                "local_cols": [],
+                "referent_schema": "public",
+                "ondelete": _FK_ACTIONS.get(on_del),
+                "onupdate": _FK_ACTIONS.get(on_upd),
+                "deferrable": deferrable,
+                "initially": "DEFERRED" if deferred else None,
+                "match": _FK_MATCH.get(match),
+            }
+        fk["local_cols"].append(col)
+    return list(refs.values())
+
+
+def _fk_name(fk: dict) -> str:
+    return fk.get("name") or f"{fk['table']}_{'_'.join(fk['local_cols'])}_fkey"
+
+
+def _fk_clause(fk: dict) -> str:
+    name = _fk_name(fk)
+    ref_schema = fk.get("referent_schema")
+    target = f"{ref_schema}.users" if ref_schema else "users"
+    ddl = (
+        f"ADD CONSTRAINT {name} "
+        f"FOREIGN KEY ({', '.join(fk['local_cols'])}) REFERENCES {target} (id)"
+    )
+    if fk.get("match"):
+        ddl += f" MATCH {fk['match']}"
+    if fk.get("ondelete"):
+        ddl += f" ON DELETE {fk['ondelete']}"
+    if fk.get("onupdate"):
+        ddl += f" ON UPDATE {fk['onupdate']}"
+    if fk.get("deferrable"):
+        ddl += " DEFERRABLE"
+    if fk.get("initially"):
+        ddl += f" INITIALLY {fk['initially']}"
+    return ddl + " NOT VALID"
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    # не висим в очереди за долгими транзакциями и не держим читателей
+    op.execute("SET lock_timeout = '2s'")
+    columns = _column_types(conn)
+
+    # собрать FKs -> users(id) одним запросом к каталогу
+    fk_refs = _users_fk_refs(conn)
+
+    # дочерние столбцы, которые ещё не BIGINT: крупные таблицы — через новый
+    # столбец, мелкие — ALTER TYPE
     touched = set()
+    swap: list = []
+    small: dict = {}
     for fk in fk_refs:
         for col in fk["local_cols"]:
             key = (fk["table"], col)
             if key in touched:
                 continue
             touched.add(key)
-            if not _col_is_bigint(conn, fk["table"], col):
-                op.alter_column(
-                    fk["table"],
-                    col,
-                    existing_type=sa.Integer(),
-                    type_=sa.BigInteger(),
-                    postgresql_using=f"{col}::bigint",
-                )
+            data_type, not_null = columns.get(key, ("", False))
+            if data_type == "bigint":
+                continue
+            if _is_large(conn, fk["table"]):
+                swap.append((fk["table"], col, not_null))
+            else:
+                small.setdefault(fk["table"], []).append(col)
+
+    # бэкфилл коммитится пачками, поэтому идёт до любых изменений FK:
+    # если миграция упадёт, повторный запуск найдёт FKs на месте
+    for table, col, _ in swap:
+        _backfill_bigint(conn, table, col)
 
-    # вернуть FKs
+    # FKs по таблицам: одна ALTER TABLE (одна блокировка) на таблицу
+    by_table: dict = {}
     for fk in fk_refs:
-        fk_kwargs = {}
-        for opt_key in ("onupdate", "ondelete", "deferrable", "initially", "match"):
-            if fk.get(opt_key) is not None:
-                fk_kwargs[opt_key] = fk[opt_key]
+        by_table.setdefault(f"{fk['schema']}.{fk['table']}", []).append(fk)
 
-        for opt_key, opt_value in (fk.get("options") or {}).items():
-            fk_kwargs.setdefault(opt_key, opt_value)
+    # снять FKs
+    for qualified, fks in by_table.items():
+        op.execute(
+            f"ALTER TABLE {qualified} "
+            + ", ".join(f"DROP CONSTRAINT {fk['name']}" for fk in fks)
+        )
 
-        op.create_foreign_key(
-            fk.get("name"),
-            fk["table"],
+    # users.id -> BIGINT (если ещё не)
+    if columns.get(("users", "id"), ("",))[0] != "bigint":
+        op.alter_column(
             "users",
-            fk["local_cols"],
-            ["id"],
-            source_schema=fk.get("schema"),
-            referent_schema=fk.get("referent_schema"),
-            **fk_kwargs,
+            "id",
+            existing_type=sa.Integer(),
+            type_=sa.BigInteger(),
+            postgresql_using="id::bigint",
         )
 
+    # дочерние столбцы -> BIGINT
+    for table, col, not_null in swap:
+        _swap_to_bigint(conn, table, col, not_null)
+    for table, cols in small.items():
+        op.execute(
+            f"ALTER TABLE {table} "
+            + ", ".join(f"ALTER COLUMN {c} TYPE bigint USING {c}::bigint" for c in cols)
+        )
+
+    # вернуть FKs: NOT VALID не сканирует таблицу
+    for qualified, fks in by_table.items():
+        op.execute(f"ALTER TABLE {qualified} " + ", ".join(_fk_clause(fk) for fk in fks))
+
+    # проверка — после коммита DDL, каждая в своей короткой транзакции
+    # (VALIDATE берёт только SHARE UPDATE EXCLUSIVE)
+    with op.get_context().autocommit_block():
+        for fk in fk_refs:
+            op.execute(
+                f"ALTER TABLE {fk['schema']}.{fk['table']} "
+                f"VALIDATE CONSTRAINT {_fk_name(fk)}"
+            )
+        _apply_not_null(conn)
+
+    # SET действует на всю сессию — следующие ревизии (CONCURRENTLY в 0009)
+    # не должны его унаследовать
+    op.execute("RESET lock_timeout")
+
 
 def downgrade() -> None:
     pass  # откат не требуется для прод
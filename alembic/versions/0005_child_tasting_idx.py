@@ -0,0 +1,33 @@
+"""Index infusions/photos by tasting_id and merge heads"""
+
+from alembic import op
+
+
+revision = "0005_child_tasting_idx"
+down_revision = ("0003_bigint_hotfix_sa2", "0004_photos_s3_fields")
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # карточка читает настои и фото по tasting_id в порядке n/id —
+    # составной индекс отдаёт их без сортировки и без seq scan
+    op.create_index(
+        "ix_infusions_tasting_n",
+        "infusions",
+        ["tasting_id", "n"],
+        unique=False,
+        if_not_exists=True,
+    )
+    op.create_index(
+        "ix_photos_tasting_id",
+        "photos",
+        ["tasting_id", "id"],
+        unique=False,
+        if_not_exists=True,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_photos_tasting_id", table_name="photos")
+    op.drop_index("ix_infusions_tasting_n", table_name="infusions")
@@ -0,0 +1,29 @@
+"""Per-user tasting number counter"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0006_user_seq"
+down_revision = "0005_child_tasting_idx"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "user_seq",
+        sa.Column("user_id", sa.BigInteger(), nullable=False),
+        sa.Column("last_seq", sa.Integer(), nullable=False, server_default="0"),
+        sa.ForeignKeyConstraint(["user_id"], ["users.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("user_id"),
+    )
+    # стартуем счётчики с уже выданных номеров
+    op.execute(
+        "INSERT INTO user_seq (user_id, last_seq) "
+        "SELECT user_id, max(seq_no) FROM tastings GROUP BY user_id"
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("user_seq")
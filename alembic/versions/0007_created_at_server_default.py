@@ -0,0 +1,35 @@
+"""created_at defaults on the server side"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0007_created_at_server_default"
+down_revision = "0006_user_seq"
+branch_labels = None
+depends_on = None
+
+# timestamp without time zone хранит UTC, как раньше datetime.utcnow()
+_UTC_NOW = sa.text("timezone('utc', now())")
+
+
+def upgrade() -> None:
+    for table in ("users", "tastings"):
+        op.alter_column(
+            table,
+            "created_at",
+            existing_type=sa.DateTime(),
+            existing_nullable=False,
+            server_default=_UTC_NOW,
+        )
+
+
+def downgrade() -> None:
+    for table in ("users", "tastings"):
+        op.alter_column(
+            table,
+            "created_at",
+            existing_type=sa.DateTime(),
+            existing_nullable=False,
+            server_default=None,
+        )
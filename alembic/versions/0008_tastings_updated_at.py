@@ -0,0 +1,19 @@
+"""Track last edit time of tastings"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0008_tastings_updated_at"
+down_revision = "0007_created_at_server_default"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # NULL у старых записей = «не редактировалась»
+    op.add_column("tastings", sa.Column("updated_at", sa.DateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column("tastings", "updated_at")
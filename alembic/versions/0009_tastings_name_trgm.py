@@ -0,0 +1,40 @@
+"""Trigram index for tasting name search (PostgreSQL)"""
+
+from alembic import op
+
+
+revision = "0009_tastings_name_trgm"
+down_revision = "0008_tastings_updated_at"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    if op.get_bind().dialect.name != "postgresql":
+        return
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    # поиск по названию — ILIKE '%q%': btree тут бесполезен, GIN по триграммам
+    # отвечает без seq scan; строим CONCURRENTLY, чтобы не блокировать записи
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_tastings_name_trgm",
+            "tastings",
+            ["name"],
+            unique=False,
+            postgresql_using="gin",
+            postgresql_ops={"name": "gin_trgm_ops"},
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name != "postgresql":
+        return
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            "ix_tastings_name_trgm",
+            table_name="tastings",
+            postgresql_concurrently=True,
+            if_exists=True,
+        )
@@ -0,0 +1,25 @@
+"""Case-insensitive category index for search"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0010_tastings_category_lower"
+down_revision = "0009_tastings_name_trgm"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # поиск по категории: user_id = :uid AND lower(category) = lower(:q)
+    op.create_index(
+        "ix_tastings_user_category_lower",
+        "tastings",
+        ["user_id", sa.text("lower(category)")],
+        unique=False,
+        if_not_exists=True,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_tastings_user_category_lower", table_name="tastings")
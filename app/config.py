@@ -1,13 +1,17 @@
 import os
 from dataclasses import dataclass
+from functools import lru_cache
 from typing import Union
 
 from dotenv import load_dotenv
 from sqlalchemy.engine import URL
 
 
+_TRUTHY = frozenset({"1", "true", "t", "yes", "y"})
+
+
 def _truthy(v: str | None) -> bool:
-    return (v or "").lower() in {"1", "true", "t", "yes", "y"}
+    return (v or "").lower() in _TRUTHY
 
 
 # Грузим .env только в дев-режиме:
@@ -20,7 +24,10 @@ if (APP_ENV is None or APP_ENV.lower() != "production") and not _truthy(
     # override=False — не перезатираем уже заданные переменные окружения
     load_dotenv(override=False)
 
+# Окружение читается один раз на процесс: геттеры ниже кэшируются.
+
 
+@lru_cache(maxsize=1)
 def get_bot_token() -> str:
     token = os.getenv("BOT_TOKEN")
     if not token:
@@ -39,6 +46,7 @@ def _pg_env_complete() -> bool:
     return all(os.getenv(item) for item in required)
 
 
+@lru_cache(maxsize=1)
 def get_db_url() -> Union[URL, str]:
     if _pg_env_complete():
         return URL.create(
@@ -53,14 +61,42 @@ def get_db_url() -> Union[URL, str]:
     return URL.create(drivername="sqlite", database="/app/tastings.db")
 
 
+@lru_cache(maxsize=1)
+def get_safe_db_url() -> str:
+    """DSN для логов и диагностики: пароль скрыт."""
+    url = get_db_url()
+    try:
+        return url.render_as_string(hide_password=True)
+    except AttributeError:
+        return str(url)
+
+
+@lru_cache(maxsize=1)
+def get_db_pool_pre_ping() -> bool:
+    return _truthy(os.getenv("DB_POOL_PRE_PING"))
+
+
+@lru_cache(maxsize=1)
 def get_app_env() -> str:
     return os.getenv("APP_ENV", "production")
 
 
+@lru_cache(maxsize=1)
 def get_tz() -> str:
     return os.getenv("TZ", "Europe/Amsterdam")
 
 
+@lru_cache(maxsize=1)
+def get_redis_url() -> str | None:
+    return os.getenv("REDIS_URL") or None
+
+
+@lru_cache(maxsize=1)
+def get_drop_pending_updates() -> bool:
+    return _truthy(os.getenv("DROP_PENDING_UPDATES"))
+
+
+@lru_cache(maxsize=1)
 def get_media_backend() -> str:
     return os.getenv("MEDIA_BACKEND", "local").lower()
 
@@ -75,6 +111,7 @@ class S3Config:
     secret_key: str | None
 
 
+@lru_cache(maxsize=1)
 def get_s3_config() -> S3Config:
     backend = get_media_backend() == "s3"
     return S3Config(
@@ -1,48 +1,102 @@
 import logging
-from contextlib import contextmanager
-from typing import Iterator, Optional, Union
+from typing import Optional, Union
 
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.engine import Engine, URL, make_url
-from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
+
+from app.config import get_db_pool_pre_ping, get_db_url
 
 
 logger = logging.getLogger(__name__)
 
-engine: Optional[Engine] = None
+async_engine: Optional[AsyncEngine] = None
 
-SessionLocal = sessionmaker(
+# сессии для хендлеров бота: не блокируют event loop на запросах к БД
+AsyncSessionLocal = async_sessionmaker(
     autoflush=False,
-    autocommit=False,
     expire_on_commit=False,
-    future=True,
 )
 
+# insert() с ON CONFLICT для поддерживаемых диалектов
+_UPSERT_INSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
 
-def create_sa_engine(db_url: Union[URL, str]) -> Engine:
-    global engine
-    url = make_url(db_url)
-    kwargs = {"pool_pre_ping": True, "future": True}
+# async-драйверы для синхронных URL из конфига
+_ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite", "sqlite+pysqlite": "sqlite+aiosqlite"}
+
+
+def _engine_kwargs(url: URL) -> dict:
+    kwargs = {}
     if url.drivername.startswith("sqlite"):
         kwargs["connect_args"] = {"check_same_thread": False}
-    engine = create_engine(url, **kwargs)
-    SessionLocal.configure(bind=engine)
+    else:
+        # вместо SELECT 1 на каждый checkout: ротация соединений + TCP keepalive
+        kwargs.update(
+            pool_recycle=1800,
+            pool_size=10,
+            max_overflow=20,
+            connect_args={
+                "keepalives": 1,
+                "keepalives_idle": 30,
+                "keepalives_interval": 10,
+                "keepalives_count": 5,
+            },
+        )
+    # pre-ping оставляем опцией для сетей с агрессивным NAT
+    if get_db_pool_pre_ping():
+        kwargs["pool_pre_ping"] = True
+    return kwargs
+
+
+def _enable_sqlite_foreign_keys(bind: Engine) -> None:
+    # без PRAGMA sqlite не исполняет ON DELETE CASCADE у проливов и фото
+    @event.listens_for(bind, "connect")
+    def _fk_pragma(dbapi_connection, _record) -> None:
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
+
+
+def create_sa_engine(db_url: Union[URL, str]) -> Engine:
+    """Синхронный движок — только для миграций Alembic."""
+    url = make_url(db_url)
+    engine = create_engine(url, future=True, **_engine_kwargs(url))
+    if url.get_backend_name() == "sqlite":
+        _enable_sqlite_foreign_keys(engine)
     return engine
 
 
-@contextmanager
-def get_session() -> Iterator[Session]:
-    session = SessionLocal()
-    try:
-        yield session
-    finally:
-        session.close()
+def create_async_sa_engine(db_url: Union[URL, str]) -> AsyncEngine:
+    global async_engine
+    url = make_url(db_url)
+    # psycopg 3 умеет async сам; sqlite переводим на aiosqlite
+    driver = _ASYNC_DRIVERS.get(url.drivername)
+    if driver:
+        url = url.set(drivername=driver)
+    async_engine = create_async_engine(url, **_engine_kwargs(url))
+    if url.get_backend_name() == "sqlite":
+        _enable_sqlite_foreign_keys(async_engine.sync_engine)
+    AsyncSessionLocal.configure(bind=async_engine)
+    return async_engine
+
+
+def get_async_engine() -> AsyncEngine:
+    """Общий async-движок процесса; создаётся лениво при первом обращении."""
+    if async_engine is None:
+        return create_async_sa_engine(get_db_url())
+    return async_engine
+
+
+def upsert_insert(bind):
+    """insert() диалекта привязки, умеющий on_conflict_do_*()."""
+    return _UPSERT_INSERTS[bind.dialect.name]
 
 
-def startup_ping(bind: Engine) -> None:
+async def startup_ping(bind: AsyncEngine) -> None:
     try:
-        with bind.connect() as connection:
-            connection.execute(text("select 1"))
+        async with bind.connect() as connection:
+            await connection.execute(text("select 1"))
         logger.info("[DB] OK")
     except Exception:
         logger.exception("[DB] FAIL")
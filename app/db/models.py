@@ -10,10 +10,15 @@ from sqlalchemy import (
     String,
     Text,
     desc,
+    func,
 )
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 
 
+def _utcnow() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+
 class Base(DeclarativeBase):
     """Base declarative class for ORM models."""
 
@@ -28,12 +33,25 @@ class User(Base):
 
     id: Mapped[int] = mapped_column(BigInteger, primary_key=True)  # telegram user_id
     created_at: Mapped[datetime.datetime] = mapped_column(
-        DateTime, default=datetime.datetime.utcnow, nullable=False
+        DateTime, server_default=func.now(), nullable=False
     )
     tz_offset_min: Mapped[int] = mapped_column(Integer, default=0)
     username: Mapped[Optional[str]] = mapped_column(String(32), nullable=True)
 
 
+class UserSeq(Base):
+    """Последний выданный пользователю номер дегустации (seq_no)."""
+
+    __tablename__ = "user_seq"
+
+    user_id: Mapped[int] = mapped_column(
+        BigInteger, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True
+    )
+    last_seq: Mapped[int] = mapped_column(
+        Integer, nullable=False, default=0, server_default="0"
+    )
+
+
 class Tasting(Base):
     __tablename__ = "tastings"
     __table_args__ = (
@@ -42,11 +60,21 @@ class Tasting(Base):
         Index("ix_tastings_user_year", "user_id", "year"),
         Index("ix_tastings_user_rating", "user_id", "rating"),
         Index("ix_tastings_user_id_desc", "user_id", desc("id")),
+        # ILIKE '%q%' по названию; только PostgreSQL (расширение pg_trgm)
+        Index(
+            "ix_tastings_name_trgm",
+            "name",
+            postgresql_using="gin",
+            postgresql_ops={"name": "gin_trgm_ops"},
+        ).ddl_if(dialect="postgresql"),
     )
+    # server_default created_at приходит через INSERT ... RETURNING при flush —
+    # create_tasting не перечитывает строку отдельным SELECT
+    __mapper_args__ = {"eager_defaults": True}
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     created_at: Mapped[datetime.datetime] = mapped_column(
-        DateTime, default=datetime.datetime.utcnow, nullable=False
+        DateTime, server_default=func.now(), nullable=False
     )
 
     # кто создал запись
@@ -87,6 +115,11 @@ class Tasting(Base):
     rating: Mapped[int] = mapped_column(Integer, default=0)
     summary: Mapped[Optional[str]] = mapped_column(nullable=True)
     seq_no: Mapped[int] = mapped_column(Integer, nullable=False)
+    # метка версии для кэша карточек; ставится в Python, чтобы не терять
+    # точность до секунд (CURRENT_TIMESTAMP в sqlite) и не перечитывать строку
+    updated_at: Mapped[Optional[datetime.datetime]] = mapped_column(
+        DateTime, nullable=True, onupdate=_utcnow
+    )
 
     infusions: Mapped[List["Infusion"]] = relationship(
         back_populates="tasting", cascade="all, delete-orphan"
@@ -106,8 +139,17 @@ class Tasting(Base):
         return " ".join(parts)
 
 
+# поиск по категории без учёта регистра: lower(category) = lower(:q)
+Index(
+    "ix_tastings_user_category_lower",
+    Tasting.user_id,
+    func.lower(Tasting.category),
+)
+
+
 class Infusion(Base):
     __tablename__ = "infusions"
+    __table_args__ = (Index("ix_infusions_tasting_n", "tasting_id", "n"),)
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     tasting_id: Mapped[int] = mapped_column(
@@ -129,7 +171,10 @@ class Infusion(Base):
 
 class Photo(Base):
     __tablename__ = "photos"
-    __table_args__ = (Index("ix_photos_object_key", "object_key"),)
+    __table_args__ = (
+        Index("ix_photos_object_key", "object_key"),
+        Index("ix_photos_tasting_id", "tasting_id", "id"),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     tasting_id: Mapped[int] = mapped_column(
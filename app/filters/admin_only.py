@@ -1,10 +1,12 @@
+from typing import Iterable
+
 from aiogram import types
 from aiogram.filters import BaseFilter
 
 
 class AdminOnly(BaseFilter):
-    def __init__(self, admins: set[int]):
-        self.admins = admins
+    def __init__(self, admins: Iterable[int]):
+        self.admins = frozenset(admins)
 
     async def __call__(self, message: types.Message) -> bool:
         uid = int(message.from_user.id) if message.from_user else None
@@ -5,7 +5,7 @@ from sqlalchemy import text
 from sqlalchemy.engine import make_url
 
 from app.config import get_app_env, get_db_url, get_tz
-from app.db.engine import SessionLocal
+from app.db.engine import AsyncSessionLocal
 
 
 # DEV-ONLY diagnostics. Не подключается в продакшне и по умолчанию в деве.
@@ -16,8 +16,8 @@ router = Router(name="public_diagnostics")
 @router.message(Command("health"))
 async def health(message: Message) -> None:
     try:
-        with SessionLocal() as session:
-            session.execute(text("select 1"))
+        async with AsyncSessionLocal() as session:
+            await session.execute(text("select 1"))
         await message.answer("DB: OK")
     except Exception as exc:
         await message.answer(f"DB: FAIL — {exc.__class__.__name__}: {exc}")
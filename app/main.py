@@ -3,14 +3,21 @@ import base64
 import datetime
 import html
 import io
+import itertools
 import logging
 import os
+import queue
 import re
+import secrets
 import time
 from contextlib import suppress
-from typing import Dict, List, Optional, Tuple, TypedDict, Union
+from functools import lru_cache
+from logging.handlers import QueueHandler, QueueListener
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence, Tuple, TypedDict, Union
+from weakref import WeakValueDictionary
 
-from aiogram import Bot, Dispatcher, F
+from aiogram import Bot, Dispatcher, F, Router
+from aiogram.client.session.aiohttp import AiohttpSession
 from aiogram.filters import CommandStart, Command, StateFilter
 from aiogram.types import (
     Message, CallbackQuery, BotCommand,
@@ -21,17 +28,37 @@ from aiogram.utils.keyboard import InlineKeyboardBuilder
     # fmt: off
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import BaseStorage
+from aiogram.fsm.storage.memory import MemoryStorage, SimpleEventIsolation
 from aiogram.exceptions import TelegramBadRequest
+from cachetools import LRUCache, TTLCache
 
-from sqlalchemy import func, select
+from sqlalchemy import Row, delete, func, select, update
+from sqlalchemy.orm import selectinload
 
-from app.config import get_bot_token, get_db_url
-from app.db.engine import SessionLocal, create_sa_engine, startup_ping
-from app.db.models import Infusion, Photo, Tasting, User
+from app.config import (
+    get_bot_token,
+    get_db_url,
+    get_drop_pending_updates,
+    get_redis_url,
+    get_safe_db_url,
+)
+from app.db.engine import (
+    AsyncSessionLocal,
+    create_async_sa_engine,
+    startup_ping,
+)
+from app.db.models import Photo, Tasting, User
 from app.routers.diagnostics import create_router
 from app.utils.admins import get_admin_ids
+from app.utils.fsm import FSMCacheMiddleware
+from app.utils.ratelimit import RateLimiter
 from app.services.tastings import create_tasting
-from app.services.users import get_or_create_user, set_user_timezone
+from app.services.users import (
+    get_or_create_user,
+    get_user_tz_offset,
+    set_user_timezone,
+)
 from app.validators import parse_float, parse_int
 # fmt: on
 
@@ -40,6 +67,30 @@ from app.validators import parse_float, parse_int
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+
+class _InProcessQueueHandler(QueueHandler):
+    # очередь в том же процессе: запись не сериализуем, форматирование
+    # (и трейсбеки logger.exception) уходит в поток listener. Только msg % args
+    # подставляем сразу — изменяемые аргументы могут поменяться до listener
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def start_log_listener() -> QueueListener:
+    """Переносит вывод логов с event loop в фоновый поток."""
+    root = logging.getLogger()
+    handlers = root.handlers[:]
+    log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(-1)
+    for handler in handlers:
+        root.removeHandler(handler)
+    root.addHandler(_InProcessQueueHandler(log_queue))
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    return listener
+
+
 IS_PROD = os.getenv("APP_ENV") == "production"
 ADMINS = get_admin_ids()
 DIAGNOSTICS_ENABLED = not (IS_PROD and not ADMINS)
@@ -56,12 +107,16 @@ TZ_OFFSET_ERROR = (
 )
 
 
-def get_user_now_hm(uid: int) -> str:
-    u = get_or_create_user(uid)
-    off = u.tz_offset_min or 0
-    now_utc = datetime.datetime.utcnow()
-    local_dt = now_utc + datetime.timedelta(minutes=off)
-    return local_dt.strftime("%H:%M")
+@lru_cache(maxsize=64)
+def _local_hm(offset_min: int, epoch_min: int) -> str:
+    # строка зависит только от сдвига и текущей минуты — общая для всех
+    # пользователей одного пояса; сдвиг берётся из кэша get_user_tz_offset
+    return time.strftime("%H:%M", time.gmtime((epoch_min + offset_min) * 60))
+
+
+async def get_user_now_hm(uid: int) -> str:
+    off = await get_user_tz_offset(uid)
+    return _local_hm(off, int(time.time()) // 60)
 
 
 def parse_tz_offset(raw: str) -> int:
@@ -112,6 +167,7 @@ def parse_tz_offset(raw: str) -> int:
     return offset
 
 
+@lru_cache(maxsize=64)
 def format_tz_offset(offset_min: int) -> str:
     sign = "+" if offset_min >= 0 else "-"
     minutes_abs = abs(offset_min)
@@ -121,28 +177,26 @@ def format_tz_offset(offset_min: int) -> str:
     return f"UTC{sign}{hours}"
 
 
-def resolve_tasting(uid: int, identifier: str) -> Optional[Tasting]:
+async def resolve_tasting(uid: int, identifier: str) -> Optional[Tasting]:
     token = (identifier or "").strip()
     if not token:
         return None
-    with SessionLocal() as s:
+    async with AsyncSessionLocal() as s:
         if token.startswith("#"):
             seq_part = token[1:]
             if not seq_part.isdigit():
                 return None
             seq_no = int(seq_part)
             return (
-                s.execute(
+                await s.execute(
                     select(Tasting).where(
                         Tasting.user_id == uid, Tasting.seq_no == seq_no
                     )
                 )
-                .scalars()
-                .first()
-            )
+            ).scalars().first()
         if not token.isdigit():
             return None
-        tasting = s.get(Tasting, int(token))
+        tasting = await s.get(Tasting, int(token))
         if tasting and tasting.user_id == uid:
             return tasting
         return None
@@ -156,8 +210,10 @@ BODY_PRESETS = ["тонкое", "лёгкое", "среднее", "плотно
 YEAR_MIN = 1900
 GRAMS_ERROR = "Граммовка от 0.1 до 50 г (например, 3.5)."
 TEMP_ERROR = "Температура от 40 до 100 °C."
+# первое целое во вводе времени пролива («45», «45 сек»)
+SECONDS_RE = re.compile(r"-?[0-9]+")
 
-EFFECTS = [
+EFFECTS = (
     "Тепло",
     "Охлаждение",
     "Расслабление",
@@ -166,18 +222,18 @@ EFFECTS = [
     "Тонус",
     "Спокойствие",
     "Сонливость",
-]
+)
 
-SCENARIOS = [
+SCENARIOS = (
     "Отдых",
     "Работа/учеба",
     "Творчество",
     "Медитация",
     "Общение",
     "Прогулка",
-]
+)
 
-DESCRIPTORS = [
+DESCRIPTORS = (
     "сухофрукты",
     "мёд",
     "хлебные",
@@ -191,9 +247,9 @@ DESCRIPTORS = [
     "овощные",
     "пряный",
     "землистый",
-]
+)
 
-AFTERTASTE_SET = [
+AFTERTASTE_SET = (
     "сладкий",
     "фруктовый",
     "ягодный",
@@ -207,16 +263,46 @@ AFTERTASTE_SET = [
     "минеральный",
     "овощной",
     "землистый",
-]
+)
 
 PAGE_SIZE = 5
 MAX_PHOTOS = 3
 CAPTION_LIMIT = 1024
 MESSAGE_LIMIT = 4096
 ALBUM_TIMEOUT = 2.0
-ALBUM_BUFFER: Dict[Tuple[int, str], dict] = {}
-MORE_THROTTLE: Dict[int, float] = {}
-MORE_THROTTLE_INTERVAL = 1.0
+ALBUM_SWEEP_INTERVAL = 0.25
+# TTL-кэши ограничивают память: брошенные альбомы и давно неактивные
+# пользователи вытесняются сами
+ALBUM_BUFFER: "TTLCache[Tuple[int, str], dict]" = TTLCache(
+    maxsize=1000, ttl=ALBUM_TIMEOUT * 10
+)
+ALBUM_TASKS: set = set()
+# «Показать ещё»: короткая серия листаний проходит, дальше не чаще раза в секунду
+MORE_BURST = 3
+MORE_RATE = 1.0
+MORE_LIMITER = RateLimiter(MORE_BURST, MORE_RATE)
+# страницы ленты по (uid, kind, extra, min_id); листание и повторный поиск
+# не ходят в БД, записи пользователя сбрасывают его страницы
+PAGE_CACHE_TTL = 60
+PAGE_CACHE: "TTLCache[Tuple[int, str, str, Optional[int]], Tuple[List[Row], bool]]" = (
+    TTLCache(maxsize=2048, ttl=PAGE_CACHE_TTL)
+)
+PREFETCH_TASKS: set = set()
+# uid -> эпоха ленты: запрос, начатый до invalidate_pages, не кладёт
+# устаревшую страницу обратно в кэш (эпохи уникальны на весь процесс)
+PAGE_EPOCHS: "LRUCache[int, int]" = LRUCache(maxsize=10_000)
+_PAGE_EPOCH_SEQ = itertools.count(1)
+# общий семафор ограничивает число одновременных запросов к Bot API
+# от всех пользователей
+SEND_CONCURRENCY = 25
+SEND_SEMAPHORE = asyncio.Semaphore(SEND_CONCURRENCY)
+# лимиты Bot API: ~30 сообщений в секунду на бота и ~1 в секунду на чат;
+# страница ленты укладывается в разрешённый всплеск, листание подряд — растягивается
+BOT_SEND_LIMITER = RateLimiter(30, 30.0, max_keys=1)
+CHAT_SEND_BURST = 10
+CHAT_SEND_LIMITER = RateLimiter(CHAT_SEND_BURST, 1.0)
+# замки живут, пока их держит хоть один хендлер, — дальше их забирает GC
+USER_LOCKS: "WeakValueDictionary[int, asyncio.Lock]" = WeakValueDictionary()
 
 
 class PhotoDraft(TypedDict):
@@ -280,7 +366,7 @@ def skip_kb(tag: str) -> InlineKeyboardBuilder:
 
 
 def kb_inf_seconds() -> InlineKeyboardMarkup:
-    return skip_kb("infsec").as_markup()
+    return SKIP_INFSEC_KB
 
 
 def time_kb() -> InlineKeyboardBuilder:
@@ -308,24 +394,52 @@ def body_kb() -> InlineKeyboardBuilder:
     return kb
 
 
+@lru_cache(maxsize=32)
+def toggle_list_labels(
+    source: Tuple[str, ...], prefix: str
+) -> Tuple[Tuple[Tuple[str, str, str], ...], str, str]:
+    """Подписи и callback_data мультивыбора: ((пункт, пункт с ✅, data), ...), other, done."""
+    items = tuple(
+        (item, f"✅ {item}", f"{prefix}:{idx}") for idx, item in enumerate(source)
+    )
+    return items, f"{prefix}:other", f"{prefix}:done"
+
+
 def toggle_list_kb(
-    source: List[str],
-    selected: List[str],
+    source: Sequence[str],
+    mask: int,
     prefix: str,
     done_text="Готово",
     include_other=False,
 ) -> InlineKeyboardBuilder:
+    items, other_cb, done_cb = toggle_list_labels(tuple(source), prefix)
     kb = InlineKeyboardBuilder()
-    for idx, item in enumerate(source):
-        mark = "✅ " if item in selected else ""
-        kb.button(text=f"{mark}{item}", callback_data=f"{prefix}:{idx}")
+    for idx, (plain, marked, cb) in enumerate(items):
+        kb.button(text=marked if mask >> idx & 1 else plain, callback_data=cb)
     if include_other:
-        kb.button(text="Другое", callback_data=f"{prefix}:other")
-    kb.button(text=done_text, callback_data=f"{prefix}:done")
+        kb.button(text="Другое", callback_data=other_cb)
+    kb.button(text=done_text, callback_data=done_cb)
     kb.adjust(2)
     return kb
 
 
+@lru_cache(maxsize=512)
+def toggle_list_markup(
+    source: Tuple[str, ...],
+    mask: int,
+    prefix: str,
+    done_text="Готово",
+    include_other=False,
+) -> InlineKeyboardMarkup:
+    """Готовая разметка мультивыбора; одинаковые маски отметок берутся из кэша."""
+    return toggle_list_kb(source, mask, prefix, done_text, include_other).as_markup()
+
+
+def mask_items(source: Sequence[str], mask: int) -> List[str]:
+    """Пункты source, отмеченные битами маски."""
+    return [item for idx, item in enumerate(source) if mask >> idx & 1]
+
+
 def rating_kb() -> InlineKeyboardBuilder:
     kb = InlineKeyboardBuilder()
     for i in range(0, 11):
@@ -361,9 +475,9 @@ def open_btn_kb(t_id: int) -> InlineKeyboardBuilder:
     return kb
 
 
-def more_btn_kb(kind: str, payload: str) -> InlineKeyboardBuilder:
+def more_btn_kb(kind: str, token: str) -> InlineKeyboardBuilder:
     kb = InlineKeyboardBuilder()
-    kb.button(text="Показать ещё", callback_data=f"more:{kind}:{payload}")
+    kb.button(text="Показать ещё", callback_data=f"more:{kind}:{token}")
     kb.adjust(1)
     return kb
 
@@ -420,33 +534,79 @@ def edit_rating_kb() -> InlineKeyboardBuilder:
     return kb
 
 
-def confirm_del_kb(t_id: int) -> InlineKeyboardBuilder:
+def edit_home_kb() -> InlineKeyboardBuilder:
+    kb = InlineKeyboardBuilder()
+    kb.button(text="⬅️ В меню", callback_data="nav:home")
+    return kb
+
+
+def confirm_del_kb(t_id: int, seq_no: int) -> InlineKeyboardBuilder:
     kb = InlineKeyboardBuilder()
-    kb.button(text="Да, удалить", callback_data=f"delok:{t_id}")
+    # номер едет в callback_data, чтобы после DELETE не перечитывать запись
+    kb.button(text="Да, удалить", callback_data=f"delok:{t_id}:{seq_no}")
     kb.button(text="Отмена", callback_data=f"delno:{t_id}")
     kb.adjust(2)
     return kb
 
 
+# ---- готовые разметки: статичные собираются один раз при импорте,
+# параметризованные — кэшируются по аргументам ----
+
+MAIN_KB = main_kb().as_markup()
+CATEGORY_KB = category_kb().as_markup()
+CATEGORY_SEARCH_KB = category_search_kb().as_markup()
+TIME_KB = time_kb().as_markup()
+YESNO_MORE_INFUSIONS_KB = yesno_more_infusions_kb().as_markup()
+BODY_KB = body_kb().as_markup()
+RATING_KB = rating_kb().as_markup()
+RATING_FILTER_KB = rating_filter_kb().as_markup()
+SEARCH_MENU_KB = search_menu_kb().as_markup()
+EDIT_FIELDS_KB = edit_fields_kb().as_markup()
+EDIT_CATEGORY_KB = edit_category_kb().as_markup()
+EDIT_RATING_KB = edit_rating_kb().as_markup()
+EDIT_HOME_KB = edit_home_kb().as_markup()
+REPLY_MAIN_KB = reply_main_kb()
+SKIP_YEAR_KB = skip_kb("year").as_markup()
+SKIP_REGION_KB = skip_kb("region").as_markup()
+SKIP_GRAMS_KB = skip_kb("grams").as_markup()
+SKIP_TEMP_KB = skip_kb("temp").as_markup()
+SKIP_GEAR_KB = skip_kb("gear").as_markup()
+SKIP_COLOR_KB = skip_kb("color").as_markup()
+SKIP_SPECIAL_KB = skip_kb("special").as_markup()
+SKIP_SUMMARY_KB = skip_kb("summary").as_markup()
+SKIP_INFSEC_KB = skip_kb("infsec").as_markup()
+
+
+@lru_cache(maxsize=4096)
+def open_btn_markup(t_id: int) -> InlineKeyboardMarkup:
+    return open_btn_kb(t_id).as_markup()
+
+
+@lru_cache(maxsize=1024)
+def card_actions_markup(t_id: int) -> InlineKeyboardMarkup:
+    return card_actions_kb(t_id).as_markup()
+
+
+@lru_cache(maxsize=1024)
+def confirm_del_markup(t_id: int, seq_no: int) -> InlineKeyboardMarkup:
+    return confirm_del_kb(t_id, seq_no).as_markup()
+
+
+_PHOTOS_DONE_BTN = InlineKeyboardButton(text="Готово", callback_data="photos:done")
+_PHOTOS_SKIP_BTN = InlineKeyboardButton(text="Пропустить", callback_data="skip:photos")
+PHOTOS_DONE_KB = InlineKeyboardMarkup(inline_keyboard=[[_PHOTOS_DONE_BTN]])
+PHOTOS_DONE_SKIP_KB = InlineKeyboardMarkup(
+    inline_keyboard=[[_PHOTOS_DONE_BTN, _PHOTOS_SKIP_BTN]]
+)
+
+
 def photo_status_markup(count: int, limit: int) -> Tuple[str, InlineKeyboardMarkup]:
     if count >= limit:
-        kb = InlineKeyboardMarkup(
-            inline_keyboard=[
-                [InlineKeyboardButton(text="Готово", callback_data="photos:done")]
-            ]
-        )
-        text = f"✅ Добавлено {count}/{limit}. Нажмите «Готово»."
-    else:
-        kb = InlineKeyboardMarkup(
-            inline_keyboard=[
-                [
-                    InlineKeyboardButton(text="Готово", callback_data="photos:done"),
-                    InlineKeyboardButton(text="Пропустить", callback_data="skip:photos"),
-                ]
-            ]
-        )
-        text = f"Добавлено {count}/{limit}. Отправьте ещё или нажмите «Готово»."
-    return text, kb
+        return f"✅ Добавлено {count}/{limit}. Нажмите «Готово».", PHOTOS_DONE_KB
+    return (
+        f"Добавлено {count}/{limit}. Отправьте ещё или нажмите «Готово».",
+        PHOTOS_DONE_SKIP_KB,
+    )
 
 
 async def update_photo_progress(
@@ -555,13 +715,18 @@ async def close_inline(call: CallbackQuery, status: str | None = None):
         return
     txt = (getattr(msg, "caption", None) if getattr(msg, "photo", None) else msg.text) or ""
     new_txt = f"{txt}\n\n✅ {status}" if status else txt
+    edited = False
     with suppress(Exception):
         if getattr(msg, "photo", None) or getattr(msg, "caption", None) is not None:
             await msg.edit_caption(new_txt)
         else:
             await msg.edit_text(new_txt)
-    with suppress(Exception):
-        await msg.edit_reply_markup()
+        edited = True
+    # правка текста без reply_markup уже снимает inline-клавиатуру; отдельный
+    # запрос нужен, только если правка не прошла, а клавиатура на сообщении есть
+    if not edited and msg.reply_markup is not None:
+        with suppress(Exception):
+            await msg.edit_reply_markup()
 
 
 async def ask_next(after: Union[CallbackQuery, Message], state: FSMContext, text: str, kb=None):
@@ -671,7 +836,7 @@ async def ui(target: Union[CallbackQuery, Message], text: str, reply_markup=None
 
 
 def get_year_max_value() -> int:
-    return datetime.datetime.utcnow().year + 1
+    return datetime.datetime.now(datetime.timezone.utc).year + 1
 
 
 def parse_year_value(raw: str) -> int:
@@ -699,7 +864,7 @@ async def ask_year_prompt(
 ) -> None:
     prompt = "📅 Укажите год сбора числом. Можно пропустить"
     await state.update_data(numpad_active=False)
-    await ask_next(target, state, prompt, skip_kb("year").as_markup())
+    await ask_next(target, state, prompt, SKIP_YEAR_KB)
     await state.set_state(NewTasting.year)
 
 
@@ -710,7 +875,7 @@ async def ask_region_prompt(
         target,
         state,
         "🗺️ Регион? Можно пропустить.",
-        skip_kb("region").as_markup(),
+        SKIP_REGION_KB,
     )
     await state.set_state(NewTasting.region)
 
@@ -723,7 +888,7 @@ async def ask_grams_prompt(
         target,
         state,
         "⚖️ Граммовка? Можно пропустить.",
-        skip_kb("grams").as_markup(),
+        SKIP_GRAMS_KB,
     )
     await state.set_state(NewTasting.grams)
 
@@ -736,7 +901,7 @@ async def ask_temp_prompt(
         target,
         state,
         "🌡️ Температура, °C? Можно пропустить.",
-        skip_kb("temp").as_markup(),
+        SKIP_TEMP_KB,
     )
     await state.set_state(NewTasting.temp_c)
 
@@ -744,15 +909,59 @@ async def ask_temp_prompt(
 async def ask_tasted_at_prompt(
     target: Union[Message, CallbackQuery], state: FSMContext, uid: int
 ) -> None:
-    now_hm = get_user_now_hm(uid)
+    now_hm = await get_user_now_hm(uid)
     text = (
         f"⏰ Время дегустации? Сейчас {now_hm}. "
         "Введи ЧЧ:ММ, нажми «🕒 Текущее время» или пропусти."
     )
-    await ask_next(target, state, text, time_kb().as_markup())
+    await ask_next(target, state, text, TIME_KB)
     await state.set_state(NewTasting.tasted_at)
 
 
+async def ask_category_prompt(
+    target: Union[Message, CallbackQuery], state: FSMContext
+) -> None:
+    await ask_next(target, state, "🏷️ Категория?", CATEGORY_KB)
+    await state.set_state(NewTasting.category)
+
+
+async def ask_gear_prompt(
+    target: Union[Message, CallbackQuery], state: FSMContext
+) -> None:
+    await ask_next(
+        target,
+        state,
+        "🍶 Посудa дегустации? Можно пропустить.",
+        SKIP_GEAR_KB,
+    )
+    await state.set_state(NewTasting.gear)
+
+
+async def ask_aroma_dry_prompt(
+    target: Union[Message, CallbackQuery], state: FSMContext
+) -> None:
+    await state.update_data(aroma_dry_mask=0)
+    await ask_next(
+        target,
+        state,
+        "🌬️ Аромат сухого листа: выбери дескрипторы и нажми «Готово», или «Другое».",
+        toggle_list_markup(DESCRIPTORS, 0, "ad", include_other=True),
+    )
+    await state.set_state(NewTasting.aroma_dry)
+
+
+async def ask_aroma_warmed_prompt(
+    target: Union[Message, CallbackQuery], state: FSMContext
+) -> None:
+    await ask_next(
+        target,
+        state,
+        "🌬️ Аромат прогретого/промытого листа: выбери и нажми «Готово».",
+        toggle_list_markup(DESCRIPTORS, 0, "aw", include_other=True),
+    )
+    await state.set_state(NewTasting.aroma_warmed)
+
+
 async def skip_year_value(message: Message, state: FSMContext) -> None:
     await state.update_data(year=None, numpad_active=False)
     await ack(message, "Год: пропущено")
@@ -792,9 +1001,18 @@ async def skip_temp_callback(call: CallbackQuery, state: FSMContext) -> None:
     await call.answer("Пропущено")
 
 
+# колонки строки ленты: лента не гидрирует Tasting целиком
+LIST_COLUMNS = (
+    Tasting.id,
+    Tasting.seq_no,
+    Tasting.category,
+    Tasting.name,
+    Tasting.year,
+    Tasting.region,
+)
 
 
-def short_row(t: Tasting) -> str:
+def short_row(t: Union[Tasting, Row]) -> str:
     meta: List[str] = []
     if t.year:
         meta.append(str(t.year))
@@ -804,10 +1022,42 @@ def short_row(t: Tasting) -> str:
     return f"#{t.seq_no} [{t.category}] {t.name}{suffix}"
 
 
+# поля пролива, попадающие в карточку
+_CARD_INFUSION_KEYS = (
+    "n",
+    "seconds",
+    "liquor_color",
+    "taste",
+    "special_notes",
+    "body",
+    "aftertaste",
+)
+# готовые тексты карточек; версия записи — (created_at, updated_at)
+_CARD_TEXT_CACHE: LRUCache = LRUCache(maxsize=2048)
+
+
 def build_card_text(
     t: Tasting,
     infusions: List[dict],
     photo_count: Optional[int] = None,
+) -> str:
+    key = (
+        t.id,
+        t.created_at,
+        t.updated_at,
+        photo_count,
+        tuple(tuple(inf.get(k) for k in _CARD_INFUSION_KEYS) for inf in infusions),
+    )
+    text = _CARD_TEXT_CACHE.get(key)
+    if text is None:
+        text = _CARD_TEXT_CACHE[key] = _render_card_text(t, infusions, photo_count)
+    return text
+
+
+def _render_card_text(
+    t: Tasting,
+    infusions: List[dict],
+    photo_count: Optional[int],
 ) -> str:
     def fmt_text(value: Optional[Union[str, int, float]]) -> str:
         if value is None:
@@ -876,55 +1126,50 @@ def build_card_text(
 
 
 def split_text_for_telegram(text: str, limit: int = MESSAGE_LIMIT) -> List[str]:
+    """Режет текст на сообщения за один проход: по абзацам, длинные — по строкам."""
     if len(text) <= limit:
         return [text]
 
     parts: List[str] = []
-    current = ""
+    buf: List[str] = []  # абзацы текущего сообщения
+    buf_len = 0
     for paragraph in text.split("\n\n"):
         paragraph = paragraph.strip()
         if not paragraph:
             continue
-        candidate = f"{current}\n\n{paragraph}" if current else paragraph
-        if len(candidate) <= limit:
-            current = candidate
-            continue
-        if current:
-            parts.append(current)
-            current = ""
-        if len(paragraph) <= limit:
-            current = paragraph
-            continue
-        for i in range(0, len(paragraph), limit):
-            parts.append(paragraph[i : i + limit])
-    if current:
-        parts.append(current)
-    if not parts:
-        return [text[:limit]]
-    # ensure each chunk is within limit by splitting on newlines if needed
-    final_parts: List[str] = []
-    for chunk in parts:
-        if len(chunk) <= limit:
-            final_parts.append(chunk)
+        size = len(paragraph)
+        if buf and buf_len + 2 + size <= limit:
+            buf.append(paragraph)
+            buf_len += 2 + size
             continue
-        buf = ""
-        for line in chunk.split("\n"):
-            line = line.strip()
-            if not line:
-                addition = ""
-            else:
-                addition = (buf + "\n" + line) if buf else line
-            if addition and len(addition) > limit:
-                if buf:
-                    final_parts.append(buf)
-                for i in range(0, len(line), limit):
-                    final_parts.append(line[i : i + limit])
-                buf = ""
-            else:
-                buf = addition
         if buf:
-            final_parts.append(buf)
-    return final_parts or [text[:limit]]
+            parts.append("\n\n".join(buf))
+            buf, buf_len = [], 0
+        if size <= limit:
+            buf, buf_len = [paragraph], size
+            continue
+
+        # абзац длиннее лимита — набираем строки, длинные строки режем
+        lines: List[str] = []
+        lines_len = 0
+        for line in paragraph.split("\n"):
+            size = len(line)
+            if lines and lines_len + 1 + size <= limit:
+                lines.append(line)
+                lines_len += 1 + size
+                continue
+            if lines:
+                parts.append("\n".join(lines))
+                lines, lines_len = [], 0
+            if size <= limit:
+                lines, lines_len = [line], size
+                continue
+            parts.extend(line[i : i + limit] for i in range(0, size, limit))
+        if lines:
+            parts.append("\n".join(lines))
+    if buf:
+        parts.append("\n\n".join(buf))
+    return parts or [text[:limit]]
 
 
 FIELD_LABELS = {
@@ -945,67 +1190,68 @@ FIELD_LABELS = {
 }
 
 
-EDIT_TEXT_FIELDS = {
-    "name": {
-        "prompt": "Пришли новое название.",
-        "allow_clear": False,
-        "column": "name",
-    },
-    "year": {
-        "prompt": "Пришли год (4 цифры) или «-» чтобы очистить.",
-        "allow_clear": True,
-        "column": "year",
-    },
-    "region": {
-        "prompt": "Пришли регион или «-» чтобы очистить.",
-        "allow_clear": True,
-        "column": "region",
-    },
-    "grams": {
-        "prompt": "Пришли граммовку (число) или «-».",
-        "allow_clear": True,
-        "column": "grams",
-    },
-    "temp_c": {
-        "prompt": "Пришли температуру (°C) или «-».",
-        "allow_clear": True,
-        "column": "temp_c",
-    },
-    "tasted_at": {
-        "prompt": "Пришли время в формате HH:MM или «-».",
-        "allow_clear": True,
-        "column": "tasted_at",
-    },
-    "gear": {
-        "prompt": "Пришли посуду или «-».",
-        "allow_clear": True,
-        "column": "gear",
-    },
-    "aroma_dry": {
-        "prompt": "Пришли аромат сухого листа или «-».",
-        "allow_clear": True,
-        "column": "aroma_dry",
-    },
-    "aroma_warmed": {
-        "prompt": "Пришли аромат прогретого/промытого листа или «-».",
-        "allow_clear": True,
-        "column": "aroma_warmed",
-    },
-    "effects": {
-        "prompt": "Пришли ощущения через запятую или «-».",
-        "allow_clear": True,
-        "column": "effects_csv",
-    },
-    "scenarios": {
-        "prompt": "Пришли сценарии через запятую или «-».",
-        "allow_clear": True,
-        "column": "scenarios_csv",
-    },
-    "summary": {
-        "prompt": "Пришли заметку или «-».",
-        "allow_clear": True,
-        "column": "summary",
-    },
+# поле -> (подсказка, можно ли очистить «-», колонка Tasting)
+EDIT_TEXT_FIELDS: Dict[str, Tuple[str, bool, str]] = {
+    "name": (
+        "Пришли новое название.",
+        False,
+        "name",
+    ),
+    "year": (
+        "Пришли год (4 цифры) или «-» чтобы очистить.",
+        True,
+        "year",
+    ),
+    "region": (
+        "Пришли регион или «-» чтобы очистить.",
+        True,
+        "region",
+    ),
+    "grams": (
+        "Пришли граммовку (число) или «-».",
+        True,
+        "grams",
+    ),
+    "temp_c": (
+        "Пришли температуру (°C) или «-».",
+        True,
+        "temp_c",
+    ),
+    "tasted_at": (
+        "Пришли время в формате HH:MM или «-».",
+        True,
+        "tasted_at",
+    ),
+    "gear": (
+        "Пришли посуду или «-».",
+        True,
+        "gear",
+    ),
+    "aroma_dry": (
+        "Пришли аромат сухого листа или «-».",
+        True,
+        "aroma_dry",
+    ),
+    "aroma_warmed": (
+        "Пришли аромат прогретого/промытого листа или «-».",
+        True,
+        "aroma_warmed",
+    ),
+    "effects": (
+        "Пришли ощущения через запятую или «-».",
+        True,
+        "effects_csv",
+    ),
+    "scenarios": (
+        "Пришли сценарии через запятую или «-».",
+        True,
+        "scenarios_csv",
+    ),
+    "summary": (
+        "Пришли заметку или «-».",
+        True,
+        "summary",
+    ),
 }
 
 
@@ -1013,10 +1259,14 @@ def edit_menu_text(seq_no: int) -> str:
     return f"Редактирование #{seq_no}. Выбери поле."
 
 
+_CSV_SPLIT_RE = re.compile(r"\s*,\s*")
+
+
 def normalize_csv_text(raw: str) -> str:
-    parts = [piece.strip() for piece in raw.split(",")]
-    filtered = [p for p in parts if p]
-    return ", ".join(filtered)
+    text = raw.strip()
+    if not text:
+        return ""
+    return ", ".join(p for p in _CSV_SPLIT_RE.split(text) if p)
 
 
 async def send_card_with_media(
@@ -1029,6 +1279,15 @@ async def send_card_with_media(
     bot = target_message.bot
     chat_id = target_message.chat.id
     photos = photos[:MAX_PHOTOS]
+    # самый частый случай: карточка без фото, влезающая в одно сообщение
+    if not photos and text_card and len(text_card) <= MESSAGE_LIMIT:
+        await bot.send_message(
+            chat_id,
+            text_card,
+            parse_mode="HTML",
+            reply_markup=reply_markup,
+        )
+        return
     markup_sent = False
 
     async def send_text_chunks(text: str) -> None:
@@ -1081,15 +1340,21 @@ async def send_card_with_media(
             await send_text_chunks(text_card)
             await ensure_actions_message()
     except Exception:
-        logging.exception("Failed to send media group for tasting %s", tasting_id)
+        logger.exception("Failed to send media group for tasting %s", tasting_id)
         await send_text_chunks(text_card)
         await ensure_actions_message()
-        for fid in photos:
-            try:
-                await bot.send_photo(chat_id, fid)
-            except Exception:
-                logging.exception(
-                    "Fallback photo send failed for tasting %s", tasting_id
+        # текст карточки уже ушёл по порядку; отдельные фото друг от друга
+        # не зависят — отправляем параллельно
+        results = await asyncio.gather(
+            *(bot.send_photo(chat_id, fid) for fid in photos),
+            return_exceptions=True,
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                logger.error(
+                    "Fallback photo send failed for tasting %s",
+                    tasting_id,
+                    exc_info=result,
                 )
 
 
@@ -1100,6 +1365,7 @@ async def _store_photo_from_file_id(
     photos: List[PhotoDraft],
     *,
     file_unique_id: Optional[str] = None,
+    persist: bool = True,
 ) -> bool:
     try:
         tg_file = await message.bot.get_file(file_id)
@@ -1129,7 +1395,8 @@ async def _store_photo_from_file_id(
             "telegram_file_unique_id": file_unique_id or file_id,
         }
     )
-    await state.update_data(new_photos=photos)
+    if persist:
+        await state.update_data(new_photos=photos)
     return True
 
 
@@ -1160,6 +1427,7 @@ async def _process_album_entry(entry: dict) -> None:
     accepted: List[dict] = files[:capacity]
     extra = len(files) - len(accepted)
     saved_any = False
+    # Альбом сохраняем в FSM одной записью, а не по записи на каждое фото.
     for file_entry in accepted:
         file_id = file_entry.get("file_id")
         if not file_id:
@@ -1170,12 +1438,15 @@ async def _process_album_entry(entry: dict) -> None:
             file_id,
             photos,
             file_unique_id=file_entry.get("file_unique_id"),
+            persist=False,
         ):
             saved_any = True
 
     if not saved_any:
         return
 
+    await state.update_data(new_photos=photos)
+
     await update_photo_progress(
         message,
         state,
@@ -1189,15 +1460,26 @@ async def _process_album_entry(entry: dict) -> None:
         )
 
 
-async def _album_timeout_handler(key: Tuple[int, str]) -> None:
+async def _process_album_safe(entry: dict) -> None:
     try:
-        await asyncio.sleep(ALBUM_TIMEOUT)
-    except asyncio.CancelledError:
-        return
-    entry = ALBUM_BUFFER.pop(key, None)
-    if not entry:
-        return
-    await _process_album_entry(entry)
+        await _process_album_entry(entry)
+    except Exception:
+        logger.exception("Failed to process album")
+
+
+async def _album_sweeper() -> None:
+    """Одна фоновая задача на процесс: сбрасывает альбомы, затихшие на ALBUM_TIMEOUT."""
+    while True:
+        await asyncio.sleep(ALBUM_SWEEP_INTERVAL)
+        now = time.monotonic()
+        for key, entry in list(ALBUM_BUFFER.items()):
+            if now - entry["last_ts"] < ALBUM_TIMEOUT:
+                continue
+            ALBUM_BUFFER.pop(key, None)
+            # альбомы разных пользователей обрабатываем параллельно
+            task = asyncio.create_task(_process_album_safe(entry))
+            ALBUM_TASKS.add(task)
+            task.add_done_callback(ALBUM_TASKS.discard)
 
 
 async def flush_user_albums(
@@ -1210,9 +1492,6 @@ async def flush_user_albums(
         entry = ALBUM_BUFFER.pop(key, None)
         if not entry:
             continue
-        task: Optional[asyncio.Task] = entry.get("task")
-        if task and not task.done():
-            task.cancel()
         if not process:
             continue
         entry["state"] = state
@@ -1239,13 +1518,13 @@ async def append_current_infusion_and_prompt(msg_or_call, state: FSMContext):
         cur_special=None,
         cur_body=None,
         cur_aftertaste=None,
-        cur_taste_sel=[],
-        cur_aftertaste_sel=[],
+        cur_taste_mask=0,
+        cur_aftertaste_mask=0,
         awaiting_custom_taste=False,
         awaiting_custom_after=False,
     )
 
-    kb = yesno_more_infusions_kb().as_markup()
+    kb = YESNO_MORE_INFUSIONS_KB
     text = "Добавить ещё пролив или завершаем?"
     await ask_next(msg_or_call, state, text, kb)
 
@@ -1279,7 +1558,8 @@ async def finalize_save(target_message: Message, state: FSMContext):
         list(data.get("new_photos", []) or [])[:MAX_PHOTOS]
     )
 
-    t = create_tasting(tasting_data, infusions_data, photo_entries)
+    t = await create_tasting(tasting_data, infusions_data, photo_entries)
+    invalidate_pages(tasting_data["user_id"])
 
     await state.clear()
 
@@ -1299,7 +1579,7 @@ async def finalize_save(target_message: Message, state: FSMContext):
         t.id,
         text_card,
         photo_ids_to_send,
-        reply_markup=card_actions_kb(t.id).as_markup(),
+        reply_markup=card_actions_markup(t.id),
     )
 
 
@@ -1360,19 +1640,19 @@ async def photo_add(message: Message, state: FSMContext):
 
     if media_group_id:
         key = (uid, media_group_id)
+        # свиппер сработает после этого апдейта: ему нужен контекст без кэша
+        # апдейта, иначе он перезапишет фото, сохранённые за это время
+        album_state = FSMContext(state.storage, state.key)
         entry = ALBUM_BUFFER.get(key)
         if not entry:
-            entry = {"files": [], "message": message, "state": state, "task": None}
+            entry = {"files": [], "message": message, "state": album_state}
             ALBUM_BUFFER[key] = entry
         entry.setdefault("files", []).append(
             {"file_id": fid, "file_unique_id": fuid}
         )
         entry["message"] = message
-        entry["state"] = state
-        task: Optional[asyncio.Task] = entry.get("task")
-        if task and not task.done():
-            task.cancel()
-        entry["task"] = asyncio.create_task(_album_timeout_handler(key))
+        entry["state"] = album_state
+        entry["last_ts"] = time.monotonic()
         return
 
     if await _store_photo_from_file_id(
@@ -1409,17 +1689,20 @@ async def show_pics(call: CallbackQuery):
         await call.answer()
         return
 
-    with SessionLocal() as s:
-        t = s.get(Tasting, tid)
-        if not t or t.user_id != call.from_user.id:
-            await ui(call, "Фото не найдены.")
-            await call.answer()
-            return
-        pics = [
-            (p.telegram_file_id or p.file_id)
-            for p in (t.photos or [])
-            if (p.telegram_file_id or p.file_id)
-        ]
+    # владелец и фото одним запросом; пустой результат — чужая/несуществующая запись
+    stmt = (
+        select(Tasting.id, Photo.telegram_file_id, Photo.file_id)
+        .outerjoin(Photo, Photo.tasting_id == Tasting.id)
+        .where(Tasting.id == tid, Tasting.user_id == call.from_user.id)
+        .order_by(Photo.id)
+    )
+    async with AsyncSessionLocal() as s:
+        rows = (await s.execute(stmt)).all()
+    if not rows:
+        await ui(call, "Фото не найдены.")
+        await call.answer()
+        return
+    pics = [tg_id or fid for _, tg_id, fid in rows if tg_id or fid]
 
     if not pics:
         await ui(call, "Фото нет.")
@@ -1441,13 +1724,17 @@ async def start_new(state: FSMContext, uid: int):
     await state.update_data(
         user_id=uid,
         infusions=[],
-        effects=[],
-        scenarios=[],
+        # мультивыборы храним битовыми масками индексов пунктов: в FSM-хранилище
+        # уходит одно число вместо списка строк; свои варианты — отдельным списком
+        effects_mask=0,
+        effects_custom=[],
+        scenarios_mask=0,
+        scenarios_custom=[],
         infusion_n=1,
-        aroma_dry_sel=[],
-        aroma_warmed_sel=[],
-        cur_taste_sel=[],
-        cur_aftertaste_sel=[],
+        aroma_dry_mask=0,
+        aroma_warmed_mask=0,
+        cur_taste_mask=0,
+        cur_aftertaste_mask=0,
         new_photos=[],
         live_q_id=None,
         numpad_active=False,
@@ -1460,7 +1747,7 @@ async def new_cmd(message: Message, state: FSMContext):
     await state.clear()
     await state.update_data(numpad_active=False)
     await flush_user_albums(uid, state, process=False)
-    get_or_create_user(uid, message.from_user.username)
+    await get_or_create_user(uid, message.from_user.username)
     await start_new(state, uid)
     await ask_next(message, state, "🍵 Название чая?")
 
@@ -1470,7 +1757,7 @@ async def new_cb(call: CallbackQuery, state: FSMContext):
     await state.clear()
     await state.update_data(numpad_active=False)
     await flush_user_albums(uid, state, process=False)
-    get_or_create_user(uid, call.from_user.username)
+    await get_or_create_user(uid, call.from_user.username)
     await start_new(state, uid)
     await close_inline(call)
     await ask_next(call, state, "🍵 Название чая?")
@@ -1486,11 +1773,11 @@ async def name_in(message: Message, state: FSMContext):
 
 
 async def year_in(message: Message, state: FSMContext):
-    if is_skip_input(message.text):
+    raw = (message.text or "").strip()
+    if is_skip_input(raw):
         await skip_year_value(message, state)
         return
 
-    raw = (message.text or "").strip()
     try:
         value = parse_year_value(raw)
     except ValueError as exc:
@@ -1506,18 +1793,16 @@ async def year_in(message: Message, state: FSMContext):
 async def region_skip(call: CallbackQuery, state: FSMContext):
     await state.update_data(region=None)
     await close_inline(call, "Регион: пропущено")
-    await ask_next(call, state, "🏷️ Категория?", category_kb().as_markup())
-    await state.set_state(NewTasting.category)
+    await ask_category_prompt(call, state)
     await call.answer()
 
 
 async def region_in(message: Message, state: FSMContext):
-    region = message.text.strip()
+    region = (message.text or "").strip()
     await state.update_data(region=region if region else None)
     if region:
         await ack(message, f"Регион: {region}")
-    await ask_next(message, state, "🏷️ Категория?", category_kb().as_markup())
-    await state.set_state(NewTasting.category)
+    await ask_category_prompt(message, state)
 
 
 async def cat_pick(call: CallbackQuery, state: FSMContext):
@@ -1530,7 +1815,8 @@ async def cat_pick(call: CallbackQuery, state: FSMContext):
         return
     await state.update_data(category=val)
     await close_inline(call, f"Категория: {val}")
-    await ask_optional_grams_edit(call, state)
+    await ask_grams_prompt(call, state)
+    await call.answer()
 
 
 async def cat_custom_in(message: Message, state: FSMContext):
@@ -1541,24 +1827,15 @@ async def cat_custom_in(message: Message, state: FSMContext):
     await state.update_data(category=category, awaiting_custom_cat=False)
     if category:
         await ack(message, f"Категория: {category}")
-    await ask_optional_grams_msg(message, state)
-
-
-async def ask_optional_grams_edit(call: CallbackQuery, state: FSMContext):
-    await ask_grams_prompt(call, state)
-    await call.answer()
-
-
-async def ask_optional_grams_msg(message: Message, state: FSMContext):
     await ask_grams_prompt(message, state)
 
 
 async def grams_in(message: Message, state: FSMContext):
-    if is_skip_input(message.text):
+    raw = (message.text or "").strip()
+    if is_skip_input(raw):
         await skip_grams_value(message, state)
         return
 
-    raw = (message.text or "").strip()
     try:
         value = parse_grams_value(raw)
     except ValueError as exc:
@@ -1572,11 +1849,11 @@ async def grams_in(message: Message, state: FSMContext):
 
 
 async def temp_in(message: Message, state: FSMContext):
-    if is_skip_input(message.text):
+    raw = (message.text or "").strip()
+    if is_skip_input(raw):
         await skip_temp_value(message, state)
         return
 
-    raw = (message.text or "").strip()
     try:
         value = parse_temp_value(raw)
     except ValueError as exc:
@@ -1590,51 +1867,33 @@ async def temp_in(message: Message, state: FSMContext):
 
 
 async def time_now(call: CallbackQuery, state: FSMContext):
-    now_hm = get_user_now_hm(call.from_user.id)
+    now_hm = await get_user_now_hm(call.from_user.id)
     await state.update_data(tasted_at=now_hm)
     await close_inline(call, f"Время дегустации: {now_hm}")
-    await ask_next(
-        call,
-        state,
-        "🍶 Посудa дегустации? Можно пропустить.",
-        skip_kb("gear").as_markup(),
-    )
-    await state.set_state(NewTasting.gear)
+    await ask_gear_prompt(call, state)
     await call.answer("Установлено текущее время")
 
 
 async def tasted_at_skip(call: CallbackQuery, state: FSMContext):
     await state.update_data(tasted_at=None)
     await close_inline(call, "Время дегустации: пропущено")
-    await ask_next(
-        call,
-        state,
-        "🍶 Посудa дегустации? Можно пропустить.",
-        skip_kb("gear").as_markup(),
-    )
-    await state.set_state(NewTasting.gear)
+    await ask_gear_prompt(call, state)
     await call.answer("Пропущено")
 
 
 async def tasted_at_in(message: Message, state: FSMContext):
-    text_val = message.text.strip()
+    text_val = (message.text or "").strip()
     ta = text_val[:5] if ":" in text_val else None
     await state.update_data(tasted_at=ta)
     if text_val:
         await ack(message, f"Время дегустации: {text_val}")
-    await ask_next(
-        message,
-        state,
-        "🍶 Посудa дегустации? Можно пропустить.",
-        skip_kb("gear").as_markup(),
-    )
-    await state.set_state(NewTasting.gear)
+    await ask_gear_prompt(message, state)
 
 
 async def gear_skip(call: CallbackQuery, state: FSMContext):
     await state.update_data(gear=None)
     await close_inline(call, "Посуда: пропущено")
-    await ask_aroma_dry_call(call, state)
+    await ask_aroma_dry_prompt(call, state)
     await call.answer()
 
 
@@ -1643,55 +1902,54 @@ async def gear_in(message: Message, state: FSMContext):
     await state.update_data(gear=text_val)
     if text_val:
         await ack(message, f"Посуда: {text_val}")
-    await ask_aroma_dry_msg(message, state)
+    await ask_aroma_dry_prompt(message, state)
 
 
 # --- ароматы
 
-async def ask_aroma_dry_msg(message: Message, state: FSMContext):
-    await state.update_data(aroma_dry_sel=[])
-    kb = toggle_list_kb(DESCRIPTORS, [], "ad", include_other=True)
-    await ask_next(
-        message,
-        state,
-        "🌬️ Аромат сухого листа: выбери дескрипторы и нажми «Готово», или «Другое».",
-        kb.as_markup(),
-    )
-    await state.set_state(NewTasting.aroma_dry)
+def user_lock(uid: int) -> asyncio.Lock:
+    """Замок пользователя: его быстрые клики обрабатываются по очереди, чужие — нет."""
+    lock = USER_LOCKS.get(uid)
+    if lock is None:
+        lock = USER_LOCKS[uid] = asyncio.Lock()
+    return lock
 
 
-async def ask_aroma_dry_call(call: CallbackQuery, state: FSMContext):
-    await state.update_data(aroma_dry_sel=[])
-    kb = toggle_list_kb(DESCRIPTORS, [], "ad", include_other=True)
-    await ask_next(
-        call,
-        state,
-        "🌬️ Аромат сухого листа: выбери дескрипторы и нажми «Готово», или «Другое».",
-        kb.as_markup(),
-    )
-    await state.set_state(NewTasting.aroma_dry)
+async def apply_toggle(
+    call: CallbackQuery,
+    state: FSMContext,
+    source: Tuple[str, ...],
+    prefix: str,
+    mask_key: str,
+    idx: int,
+) -> None:
+    """Переключает пункт idx и перерисовывает мультивыбор."""
+    # чтение-изменение-запись маски под замком: двойной клик не теряет отметку
+    async with user_lock(call.from_user.id):
+        data = await state.get_data()
+        mask = data.get(mask_key, 0) ^ (1 << idx)
+        await state.update_data({mask_key: mask})
+        kb = toggle_list_markup(source, mask, prefix, include_other=True)
+        try:
+            await call.message.edit_reply_markup(reply_markup=kb)
+        except TelegramBadRequest:
+            pass
+    await call.answer()
 
 
 async def aroma_dry_toggle(call: CallbackQuery, state: FSMContext):
     _, tail = call.data.split(":", 1)
-    data = await state.get_data()
-    selected = data.get("aroma_dry_sel", [])
     if tail == "done":
+        data = await state.get_data()
+        selected = mask_items(DESCRIPTORS, data.get("aroma_dry_mask", 0))
         value = ", ".join(selected) if selected else None
         await state.update_data(
             aroma_dry=value,
             awaiting_custom_ad=False,
         )
-        kb = toggle_list_kb(DESCRIPTORS, [], "aw", include_other=True)
         summary = value if value else "не выбрано"
         await close_inline(call, f"Аромат сухого листа: {summary}")
-        await ask_next(
-            call,
-            state,
-            "🌬️ Аромат прогретого/промытого листа: выбери и нажми «Готово».",
-            kb.as_markup(),
-        )
-        await state.set_state(NewTasting.aroma_warmed)
+        await ask_aroma_warmed_prompt(call, state)
         await call.answer()
         return
     if tail == "other":
@@ -1700,26 +1958,14 @@ async def aroma_dry_toggle(call: CallbackQuery, state: FSMContext):
         await ask_next(call, state, "Введи аромат сухого листа текстом:")
         await call.answer()
         return
-    idx = int(tail)
-    item = DESCRIPTORS[idx]
-    if item in selected:
-        selected.remove(item)
-    else:
-        selected.append(item)
-    await state.update_data(aroma_dry_sel=selected)
-    kb = toggle_list_kb(DESCRIPTORS, selected, "ad", include_other=True)
-    try:
-        await call.message.edit_reply_markup(reply_markup=kb.as_markup())
-    except TelegramBadRequest:
-        pass
-    await call.answer()
+    await apply_toggle(call, state, DESCRIPTORS, "ad", "aroma_dry_mask", int(tail))
 
 
 async def aroma_dry_custom(message: Message, state: FSMContext):
     data = await state.get_data()
     if not data.get("awaiting_custom_ad"):
         return
-    selected = data.get("aroma_dry_sel", [])
+    selected = mask_items(DESCRIPTORS, data.get("aroma_dry_mask", 0))
     txt = (message.text or "").strip()
     if txt:
         selected.append(txt)
@@ -1729,21 +1975,14 @@ async def aroma_dry_custom(message: Message, state: FSMContext):
     )
     summary = ", ".join(selected) if selected else "не выбрано"
     await ack(message, f"Аромат сухого листа: {summary}")
-    kb = toggle_list_kb(DESCRIPTORS, [], "aw", include_other=True)
-    await ask_next(
-        message,
-        state,
-        "🌬️ Аромат прогретого/промытого листа: выбери и нажми «Готово».",
-        kb.as_markup(),
-    )
-    await state.set_state(NewTasting.aroma_warmed)
+    await ask_aroma_warmed_prompt(message, state)
 
 
 async def aroma_warmed_toggle(call: CallbackQuery, state: FSMContext):
     _, tail = call.data.split(":", 1)
-    data = await state.get_data()
-    selected = data.get("aroma_warmed_sel", [])
     if tail == "done":
+        data = await state.get_data()
+        selected = mask_items(DESCRIPTORS, data.get("aroma_warmed_mask", 0))
         value = ", ".join(selected) if selected else None
         await state.update_data(
             aroma_warmed=value,
@@ -1751,7 +1990,8 @@ async def aroma_warmed_toggle(call: CallbackQuery, state: FSMContext):
         )
         summary = value if value else "не выбрано"
         await close_inline(call, f"Аромат прогретого листа: {summary}")
-        await start_infusion_block_call(call, state)
+        await prompt_infusion_seconds(call, state)
+        await call.answer()
         return
     if tail == "other":
         await state.update_data(awaiting_custom_aw=True)
@@ -1759,26 +1999,14 @@ async def aroma_warmed_toggle(call: CallbackQuery, state: FSMContext):
         await ask_next(call, state, "Введи аромат прогретого/промытого листа текстом:")
         await call.answer()
         return
-    idx = int(tail)
-    item = DESCRIPTORS[idx]
-    if item in selected:
-        selected.remove(item)
-    else:
-        selected.append(item)
-    await state.update_data(aroma_warmed_sel=selected)
-    kb = toggle_list_kb(DESCRIPTORS, selected, "aw", include_other=True)
-    try:
-        await call.message.edit_reply_markup(reply_markup=kb.as_markup())
-    except TelegramBadRequest:
-        pass
-    await call.answer()
+    await apply_toggle(call, state, DESCRIPTORS, "aw", "aroma_warmed_mask", int(tail))
 
 
 async def aroma_warmed_custom(message: Message, state: FSMContext):
     data = await state.get_data()
     if not data.get("awaiting_custom_aw"):
         return
-    selected = data.get("aroma_warmed_sel", [])
+    selected = mask_items(DESCRIPTORS, data.get("aroma_warmed_mask", 0))
     txt = (message.text or "").strip()
     if txt:
         selected.append(txt)
@@ -1789,7 +2017,7 @@ async def aroma_warmed_custom(message: Message, state: FSMContext):
     )
     summary = value if value else "не выбрано"
     await ack(message, f"Аромат прогретого листа: {summary}")
-    await start_infusion_block_msg(message, state)
+    await prompt_infusion_seconds(message, state)
 
 
 # --- проливы
@@ -1804,31 +2032,16 @@ async def prompt_infusion_seconds(
     await state.set_state(InfusionState.seconds)
 
 
-async def start_infusion_block_msg(message: Message, state: FSMContext):
-    await prompt_infusion_seconds(message, state)
-
-
-async def start_infusion_block_call(call: CallbackQuery, state: FSMContext):
-    await prompt_infusion_seconds(call, state)
-    await call.answer()
-
-
 async def inf_seconds(message: Message, state: FSMContext):
-    if is_skip_input(message.text):
+    text = (message.text or "").strip()
+    if is_skip_input(text):
         await state.update_data(cur_seconds=None, numpad_active=False)
         await ack(message, "Время пролива: пропущено")
         await proceed_to_infusion_color(message, state)
         return
 
-    text = (message.text or "").strip()
-    seconds_value: Optional[int] = None
-    if text:
-        match = re.search(r"-?\d+", text)
-        if match:
-            try:
-                seconds_value = int(match.group())
-            except ValueError:
-                seconds_value = None
+    match = SECONDS_RE.search(text)
+    seconds_value: Optional[int] = int(match.group()) if match else None
     await state.update_data(cur_seconds=seconds_value, numpad_active=False)
     status = (
         f"Время пролива: {seconds_value} сек" if seconds_value is not None else "Время пролива: пропущено"
@@ -1847,7 +2060,7 @@ async def inf_seconds_skip(call: CallbackQuery, state: FSMContext):
 async def proceed_to_infusion_color(
     target: Union[Message, CallbackQuery], state: FSMContext
 ) -> None:
-    markup = skip_kb("color").as_markup()
+    markup = SKIP_COLOR_KB
     await ask_next(
         target,
         state,
@@ -1857,53 +2070,74 @@ async def proceed_to_infusion_color(
     await state.set_state(InfusionState.color)
 
 
-async def color_skip(call: CallbackQuery, state: FSMContext):
-    await state.update_data(cur_color=None)
-    await state.update_data(cur_taste_sel=[])
-    kb = toggle_list_kb(DESCRIPTORS, [], "taste", include_other=True)
-    await close_inline(call, "Цвет пролива: пропущено")
+async def ask_taste_prompt(
+    target: Union[Message, CallbackQuery], state: FSMContext
+) -> None:
     await ask_next(
-        call,
+        target,
         state,
         "Вкус настоя: выбери дескрипторы и нажми «Готово», или «Другое».",
-        kb.as_markup(),
+        toggle_list_markup(DESCRIPTORS, 0, "taste", include_other=True),
     )
     await state.set_state(InfusionState.taste)
+
+
+async def ask_special_prompt(
+    target: Union[Message, CallbackQuery], state: FSMContext
+) -> None:
+    await ask_next(
+        target,
+        state,
+        "✨ Особенные ноты пролива? (можно пропустить)",
+        SKIP_SPECIAL_KB,
+    )
+    await state.set_state(InfusionState.special)
+
+
+async def ask_body_prompt(
+    target: Union[Message, CallbackQuery], state: FSMContext
+) -> None:
+    await ask_next(target, state, "Тело настоя?", BODY_KB)
+    await state.set_state(InfusionState.body)
+
+
+async def ask_aftertaste_prompt(
+    target: Union[Message, CallbackQuery], state: FSMContext
+) -> None:
+    await ask_next(
+        target,
+        state,
+        "Характер послевкусия: выбери пункты и нажми «Готово», или «Другое».",
+        toggle_list_markup(AFTERTASTE_SET, 0, "aft", include_other=True),
+    )
+    await state.set_state(InfusionState.aftertaste)
+
+
+async def color_skip(call: CallbackQuery, state: FSMContext):
+    await state.update_data(cur_color=None, cur_taste_mask=0)
+    await close_inline(call, "Цвет пролива: пропущено")
+    await ask_taste_prompt(call, state)
     await call.answer()
 
 
 async def inf_color(message: Message, state: FSMContext):
     text_val = (message.text or "").strip()
-    await state.update_data(cur_color=text_val)
-    await state.update_data(cur_taste_sel=[])
-    kb = toggle_list_kb(DESCRIPTORS, [], "taste", include_other=True)
+    await state.update_data(cur_color=text_val, cur_taste_mask=0)
     if text_val:
         await ack(message, f"Цвет пролива: {text_val}")
-    await ask_next(
-        message,
-        state,
-        "Вкус настоя: выбери дескрипторы и нажми «Готово», или «Другое».",
-        kb.as_markup(),
-    )
-    await state.set_state(InfusionState.taste)
+    await ask_taste_prompt(message, state)
 
 
 async def taste_toggle(call: CallbackQuery, state: FSMContext):
     _, tail = call.data.split(":", 1)
-    data = await state.get_data()
-    selected = data.get("cur_taste_sel", [])
     if tail == "done":
+        data = await state.get_data()
+        selected = mask_items(DESCRIPTORS, data.get("cur_taste_mask", 0))
         text_val = ", ".join(selected) if selected else None
         await state.update_data(cur_taste=text_val, awaiting_custom_taste=False)
         summary = text_val if text_val else "не выбрано"
         await close_inline(call, f"Вкус пролива: {summary}")
-        await ask_next(
-            call,
-            state,
-            "✨ Особенные ноты пролива? (можно пропустить)",
-            skip_kb("special").as_markup(),
-        )
-        await state.set_state(InfusionState.special)
+        await ask_special_prompt(call, state)
         await call.answer()
         return
     if tail == "other":
@@ -1912,51 +2146,15 @@ async def taste_toggle(call: CallbackQuery, state: FSMContext):
         await ask_next(call, state, "Введи вкус текстом:")
         await call.answer()
         return
-    idx = int(tail)
-    item = DESCRIPTORS[idx]
-    if item in selected:
-        selected.remove(item)
-    else:
-        selected.append(item)
-    await state.update_data(cur_taste_sel=selected)
-    kb = toggle_list_kb(DESCRIPTORS, selected, "taste", include_other=True)
-    try:
-        await call.message.edit_reply_markup(reply_markup=kb.as_markup())
-    except TelegramBadRequest:
-        pass
-    await call.answer()
+    await apply_toggle(call, state, DESCRIPTORS, "taste", "cur_taste_mask", int(tail))
 
 
 async def taste_custom(message: Message, state: FSMContext):
-    data = await state.get_data()
-    if not data.get("awaiting_custom_taste"):
-        text_val = (message.text or "").strip() or None
-        await state.update_data(cur_taste=text_val, awaiting_custom_taste=False)
-        summary = text_val if text_val else "не указано"
-        await ack(message, f"Вкус пролива: {summary}")
-        await ask_next(
-            message,
-            state,
-            "✨ Особенные ноты пролива? (можно пропустить)",
-            skip_kb("special").as_markup(),
-        )
-        await state.set_state(InfusionState.special)
-        return
-
     text_val = (message.text or "").strip() or None
-    await state.update_data(
-        cur_taste=text_val,
-        awaiting_custom_taste=False,
-    )
+    await state.update_data(cur_taste=text_val, awaiting_custom_taste=False)
     summary = text_val if text_val else "не указано"
     await ack(message, f"Вкус пролива: {summary}")
-    await ask_next(
-        message,
-        state,
-        "✨ Особенные ноты пролива? (можно пропустить)",
-        skip_kb("special").as_markup(),
-    )
-    await state.set_state(InfusionState.special)
+    await ask_special_prompt(message, state)
 
 
 async def inf_taste(message: Message, state: FSMContext):
@@ -1967,20 +2165,13 @@ async def inf_taste(message: Message, state: FSMContext):
     )
     summary = text_val if text_val else "не указано"
     await ack(message, f"Вкус пролива: {summary}")
-    await ask_next(
-        message,
-        state,
-        "✨ Особенные ноты пролива? (можно пропустить)",
-        skip_kb("special").as_markup(),
-    )
-    await state.set_state(InfusionState.special)
+    await ask_special_prompt(message, state)
 
 
 async def special_skip(call: CallbackQuery, state: FSMContext):
     await state.update_data(cur_special=None)
     await close_inline(call, "Особенные ноты: пропущено")
-    await ask_next(call, state, "Тело настоя?", body_kb().as_markup())
-    await state.set_state(InfusionState.body)
+    await ask_body_prompt(call, state)
     await call.answer()
 
 
@@ -1989,8 +2180,7 @@ async def inf_special(message: Message, state: FSMContext):
     await state.update_data(cur_special=text_val)
     if text_val:
         await ack(message, f"Особенные ноты: {text_val}")
-    await ask_next(message, state, "Тело настоя?", body_kb().as_markup())
-    await state.set_state(InfusionState.body)
+    await ask_body_prompt(message, state)
 
 
 async def inf_body_pick(call: CallbackQuery, state: FSMContext):
@@ -2002,17 +2192,9 @@ async def inf_body_pick(call: CallbackQuery, state: FSMContext):
         await ask_next(call, state, "Введи тело настоя текстом:")
         await call.answer()
         return
-    await state.update_data(cur_body=val)
-    await state.update_data(cur_aftertaste_sel=[])
-    kb = toggle_list_kb(AFTERTASTE_SET, [], "aft", include_other=True)
+    await state.update_data(cur_body=val, cur_aftertaste_mask=0)
     await close_inline(call, f"Тело настоя: {val}")
-    await ask_next(
-        call,
-        state,
-        "Характер послевкусия: выбери пункты и нажми «Готово», или «Другое».",
-        kb.as_markup(),
-    )
-    await state.set_state(InfusionState.aftertaste)
+    await ask_aftertaste_prompt(call, state)
     await call.answer()
 
 
@@ -2028,26 +2210,19 @@ async def inf_body_custom(message: Message, state: FSMContext):
         await ack(message, f"Тело настоя: {text_val}")
     else:
         await ack(message, "Тело настоя: не указано")
-    kb = toggle_list_kb(AFTERTASTE_SET, [], "aft", include_other=True)
-    await ask_next(
-        message,
-        state,
-        "Характер послевкусия: выбери пункты и нажми «Готово», или «Другое».",
-        kb.as_markup(),
-    )
-    await state.set_state(InfusionState.aftertaste)
+    await ask_aftertaste_prompt(message, state)
 
 
 async def aftertaste_toggle(call: CallbackQuery, state: FSMContext):
     _, tail = call.data.split(":", 1)
-    data = await state.get_data()
-    selected = data.get("cur_aftertaste_sel", [])
     if tail == "done":
+        data = await state.get_data()
+        selected = mask_items(AFTERTASTE_SET, data.get("cur_aftertaste_mask", 0))
+        value = ", ".join(selected) if selected else None
         await state.update_data(
-            cur_aftertaste=", ".join(selected) if selected else None,
+            cur_aftertaste=value,
             awaiting_custom_after=False,
         )
-        value = ", ".join(selected) if selected else None
         summary = value if value else "не выбрано"
         await close_inline(call, f"Послевкусие: {summary}")
         await append_current_infusion_and_prompt(call, state)
@@ -2059,19 +2234,9 @@ async def aftertaste_toggle(call: CallbackQuery, state: FSMContext):
         await ask_next(call, state, "Введи характер послевкусия текстом:")
         await call.answer()
         return
-    idx = int(tail)
-    item = AFTERTASTE_SET[idx]
-    if item in selected:
-        selected.remove(item)
-    else:
-        selected.append(item)
-    await state.update_data(cur_aftertaste_sel=selected)
-    kb = toggle_list_kb(AFTERTASTE_SET, selected, "aft", include_other=True)
-    try:
-        await call.message.edit_reply_markup(reply_markup=kb.as_markup())
-    except TelegramBadRequest:
-        pass
-    await call.answer()
+    await apply_toggle(
+        call, state, AFTERTASTE_SET, "aft", "cur_aftertaste_mask", int(tail)
+    )
 
 
 async def aftertaste_custom(message: Message, state: FSMContext):
@@ -2106,18 +2271,20 @@ async def aftertaste_custom(message: Message, state: FSMContext):
 
 async def more_infusions(call: CallbackQuery, state: FSMContext):
     await close_inline(call, "Добавляем пролив")
-    await start_infusion_block_call(call, state)
+    await prompt_infusion_seconds(call, state)
+    await call.answer()
 
 
 async def ask_effects_prompt(target: Union[Message, CallbackQuery], state: FSMContext) -> None:
     data = await state.get_data()
-    selected = data.get("effects", [])
-    kb = toggle_list_kb(EFFECTS, selected, prefix="eff", include_other=True)
+    kb = toggle_list_markup(
+        EFFECTS, data.get("effects_mask", 0), prefix="eff", include_other=True
+    )
     await ask_next(
         target,
         state,
         "Ощущения (мультивыбор). Жми пункты, затем «Готово», либо «Другое».",
-        kb.as_markup(),
+        kb,
     )
     await state.set_state(EffectsScenarios.effects)
 
@@ -2132,12 +2299,14 @@ async def finish_infusions(call: CallbackQuery, state: FSMContext):
 
 async def eff_toggle_or_done(call: CallbackQuery, state: FSMContext):
     _, tail = call.data.split(":", 1)
-    data = await state.get_data()
-    selected = data.get("effects", [])
     if tail == "done":
-        kb = toggle_list_kb(
+        data = await state.get_data()
+        selected = mask_items(EFFECTS, data.get("effects_mask", 0))
+        selected += data.get("effects_custom", [])
+        await state.update_data(effects=selected)
+        kb = toggle_list_markup(
             SCENARIOS,
-            data.get("scenarios", []),
+            data.get("scenarios_mask", 0),
             prefix="scn",
             include_other=True,
         )
@@ -2147,7 +2316,7 @@ async def eff_toggle_or_done(call: CallbackQuery, state: FSMContext):
             call,
             state,
             "Сценарии (мультивыбор). Жми пункты, затем «Готово», либо «Другое».",
-            kb.as_markup(),
+            kb,
         )
         await state.set_state(EffectsScenarios.scenarios)
         await call.answer()
@@ -2158,34 +2327,20 @@ async def eff_toggle_or_done(call: CallbackQuery, state: FSMContext):
         await ask_next(call, state, "Введи ощущение текстом:")
         await call.answer()
         return
-    idx = int(tail)
-    item = EFFECTS[idx]
-    if item in selected:
-        selected.remove(item)
-    else:
-        selected.append(item)
-    await state.update_data(effects=selected)
-    kb = toggle_list_kb(
-        EFFECTS, selected, prefix="eff", include_other=True
-    )
-    try:
-        await call.message.edit_reply_markup(reply_markup=kb.as_markup())
-    except TelegramBadRequest:
-        pass
-    await call.answer()
+    await apply_toggle(call, state, EFFECTS, "eff", "effects_mask", int(tail))
 
 
 async def eff_custom(message: Message, state: FSMContext):
     data = await state.get_data()
     if not data.get("awaiting_custom_eff"):
         return
-    selected = data.get("effects", [])
-    txt = message.text.strip()
+    custom = data.get("effects_custom", [])
+    txt = (message.text or "").strip()
     if txt:
-        selected.append(txt)
-    await state.update_data(effects=selected, awaiting_custom_eff=False)
-    kb = toggle_list_kb(
-        EFFECTS, selected, prefix="eff", include_other=True
+        custom.append(txt)
+    await state.update_data(effects_custom=custom, awaiting_custom_eff=False)
+    kb = toggle_list_markup(
+        EFFECTS, data.get("effects_mask", 0), prefix="eff", include_other=True
     )
     if txt:
         await ack(message, f"Ощущения: добавлено {txt}")
@@ -2193,19 +2348,21 @@ async def eff_custom(message: Message, state: FSMContext):
         message,
         state,
         "Ощущения (мультивыбор). Жми пункты, затем «Готово», либо «Другое».",
-        kb.as_markup(),
+        kb,
     )
     await state.set_state(EffectsScenarios.effects)
 
 
 async def scn_toggle_or_done(call: CallbackQuery, state: FSMContext):
     _, tail = call.data.split(":", 1)
-    data = await state.get_data()
-    selected = data.get("scenarios", [])
     if tail == "done":
+        data = await state.get_data()
+        selected = mask_items(SCENARIOS, data.get("scenarios_mask", 0))
+        selected += data.get("scenarios_custom", [])
+        await state.update_data(scenarios=selected)
         summary = ", ".join(selected) if selected else "не выбрано"
         await close_inline(call, f"Сценарии: {summary}")
-        await ask_next(call, state, "Оценка сорта 0..10?", rating_kb().as_markup())
+        await ask_next(call, state, "Оценка сорта 0..10?", RATING_KB)
         await state.set_state(RatingSummary.rating)
         await call.answer()
         return
@@ -2215,34 +2372,20 @@ async def scn_toggle_or_done(call: CallbackQuery, state: FSMContext):
         await ask_next(call, state, "Введи сценарий текстом:")
         await call.answer()
         return
-    idx = int(tail)
-    item = SCENARIOS[idx]
-    if item in selected:
-        selected.remove(item)
-    else:
-        selected.append(item)
-    await state.update_data(scenarios=selected)
-    kb = toggle_list_kb(
-        SCENARIOS, selected, prefix="scn", include_other=True
-    )
-    try:
-        await call.message.edit_reply_markup(reply_markup=kb.as_markup())
-    except TelegramBadRequest:
-        pass
-    await call.answer()
+    await apply_toggle(call, state, SCENARIOS, "scn", "scenarios_mask", int(tail))
 
 
 async def scn_custom(message: Message, state: FSMContext):
     data = await state.get_data()
     if not data.get("awaiting_custom_scn"):
         return
-    selected = data.get("scenarios", [])
-    txt = message.text.strip()
+    custom = data.get("scenarios_custom", [])
+    txt = (message.text or "").strip()
     if txt:
-        selected.append(txt)
-    await state.update_data(scenarios=selected, awaiting_custom_scn=False)
-    kb = toggle_list_kb(
-        SCENARIOS, selected, prefix="scn", include_other=True
+        custom.append(txt)
+    await state.update_data(scenarios_custom=custom, awaiting_custom_scn=False)
+    kb = toggle_list_markup(
+        SCENARIOS, data.get("scenarios_mask", 0), prefix="scn", include_other=True
     )
     if txt:
         await ack(message, f"Сценарий добавлен: {txt}")
@@ -2250,38 +2393,38 @@ async def scn_custom(message: Message, state: FSMContext):
         message,
         state,
         "Сценарии (мультивыбор). Жми пункты, затем «Готово», либо «Другое».",
-        kb.as_markup(),
+        kb,
     )
     await state.set_state(EffectsScenarios.scenarios)
 
 
-async def rate_pick(call: CallbackQuery, state: FSMContext):
-    _, val = call.data.split(":", 1)
-    await state.update_data(rating=int(val))
-    await close_inline(call, f"Оценка: {val}/10")
+async def ask_summary_prompt(
+    target: Union[Message, CallbackQuery], state: FSMContext
+) -> None:
     await ask_next(
-        call,
+        target,
         state,
         "📝 Заметка по дегустации? (можно пропустить)",
-        skip_kb("summary").as_markup(),
+        SKIP_SUMMARY_KB,
     )
     await state.set_state(RatingSummary.summary)
+
+
+async def rate_pick(call: CallbackQuery, state: FSMContext):
+    _, val = call.data.split(":", 1)
+    await state.update_data(rating=int(val))
+    await close_inline(call, f"Оценка: {val}/10")
+    await ask_summary_prompt(call, state)
     await call.answer()
 
 
 async def rating_in(message: Message, state: FSMContext):
-    txt = message.text.strip()
+    txt = (message.text or "").strip()
     rating = int(txt) if txt.isdigit() else 0
     rating = max(0, min(10, rating))
     await state.update_data(rating=rating)
     await ack(message, f"Оценка: {rating}/10")
-    await ask_next(
-        message,
-        state,
-        "📝 Заметка по дегустации? (можно пропустить)",
-        skip_kb("summary").as_markup(),
-    )
-    await state.set_state(RatingSummary.summary)
+    await ask_summary_prompt(message, state)
 
 
 async def summary_in(message: Message, state: FSMContext):
@@ -2302,94 +2445,150 @@ async def summary_skip(call: CallbackQuery, state: FSMContext):
 # ---------------- ПОИСК / ЛЕНТА ----------------
 
 
-def encode_more_payload(uid: int, min_id: int, extra: str = "") -> str:
-    encoded_extra = (
-        base64.urlsafe_b64encode(extra.encode("utf-8")).decode("ascii").rstrip("=")
-        if extra
-        else ""
-    )
-    return f"{uid}|{min_id}|{encoded_extra}"
+# курсоры «Показать ещё» живут на сервере: в callback_data уходит только
+# короткий токен, а фильтр (категория/название могут быть длинными) остаётся тут
+CURSOR_TTL = 600
+CURSORS: "TTLCache[str, Tuple[int, str, str, int]]" = TTLCache(
+    maxsize=10_000, ttl=CURSOR_TTL
+)
 
 
-def decode_more_payload(payload: str) -> Tuple[int, int, str]:
-    parts = payload.split("|", 2)
-    if len(parts) < 2:
-        raise ValueError
-    uid = int(parts[0])
-    min_id = int(parts[1])
-    extra_enc = parts[2] if len(parts) > 2 else ""
-    if extra_enc:
-        padding = "=" * (-len(extra_enc) % 4)
-        extra = base64.urlsafe_b64decode(extra_enc + padding).decode("utf-8")
-    else:
-        extra = ""
-    return uid, min_id, extra
+def save_cursor(uid: int, kind: str, extra: str, min_id: int) -> str:
+    token = secrets.token_urlsafe(6)
+    CURSORS[token] = (uid, kind, extra, min_id)
+    return token
 
 
-def apply_search_filters(stmt, kind: str, extra: str):
-    extra_clean = (extra or "").strip()
-    if kind == "last":
-        return stmt
-    if kind == "name":
-        if not extra_clean:
-            return None
-        return stmt.where(Tasting.name.ilike(f"%{extra_clean}%"))
-    if kind == "cat":
-        if not extra_clean:
-            return None
-        return stmt.where(Tasting.category.ilike(extra_clean))
-    if kind == "year":
-        if not extra_clean.isdigit():
-            return None
-        return stmt.where(Tasting.year == int(extra_clean))
-    if kind == "rating":
-        try:
-            thr = int(extra_clean)
-        except Exception:
-            return None
-        return stmt.where(Tasting.rating >= thr)
-    return None
+def load_cursor(token: str, uid: int, kind: str) -> Optional[Tuple[str, int]]:
+    """(extra, min_id) курсора или None, если он истёк или чужой."""
+    cursor = CURSORS.get(token)
+    if cursor is None or cursor[0] != uid or cursor[1] != kind:
+        return None
+    return cursor[2], cursor[3]
 
 
-def fetch_tastings_page(
+def _rating_filter(extra: str) -> Optional[list]:
+    try:
+        thr = int(extra)
+    except Exception:
+        return None
+    return [Tasting.rating >= thr]
+
+
+# вид поиска -> построитель условий по очищенному extra (None — пустой запрос)
+_SEARCH_FILTERS = {
+    "last": lambda extra: [],
+    "name": lambda extra: [Tasting.name.ilike(f"%{extra}%")] if extra else None,
+    # точное сравнение без учёта регистра вместо ILIKE: идёт по индексу
+    # ix_tastings_user_category_lower; lower() с обеих сторон на стороне БД,
+    # чтобы sqlite (lower только для ASCII) сравнивал согласованно
+    "cat": lambda extra: (
+        [func.lower(Tasting.category) == func.lower(extra)] if extra else None
+    ),
+    "year": lambda extra: [Tasting.year == int(extra)] if extra.isdigit() else None,
+    "rating": _rating_filter,
+}
+
+
+def search_filters(kind: str, extra: str) -> Optional[list]:
+    """Условия WHERE для вида поиска; None — запрос заведомо пустой."""
+    builder = _SEARCH_FILTERS.get(kind)
+    if builder is None:
+        return None
+    return builder((extra or "").strip())
+
+
+async def fetch_tastings_page(
     uid: int, kind: str, extra: str, min_id: Optional[int] = None
-) -> Tuple[List[Tasting], bool]:
-    with SessionLocal() as s:
-        stmt = select(Tasting).where(Tasting.user_id == uid)
-        stmt = apply_search_filters(stmt, kind, extra)
-        if stmt is None:
-            return [], False
-        if min_id is not None:
-            stmt = stmt.where(Tasting.id < min_id)
-        stmt = stmt.order_by(Tasting.id.desc()).limit(PAGE_SIZE)
-        rows = s.execute(stmt).scalars().all()
-        if not rows:
-            return [], False
-
-        next_stmt = select(Tasting.id).where(Tasting.user_id == uid)
-        next_stmt = apply_search_filters(next_stmt, kind, extra)
-        if next_stmt is None:
-            return rows, False
-        next_stmt = next_stmt.where(Tasting.id < rows[-1].id)
-        next_stmt = next_stmt.order_by(Tasting.id.desc()).limit(1)
-        more = s.execute(next_stmt).scalars().first() is not None
-        return rows, more
+) -> Tuple[List[Row], bool]:
+    key = (uid, kind, extra, min_id)
+    cached = PAGE_CACHE.get(key)
+    if cached is not None:
+        return cached
+    filters = search_filters(kind, extra)
+    if filters is None:
+        return [], False
+    filters.insert(0, Tasting.user_id == uid)
+    epoch = PAGE_EPOCHS.get(uid, 0)
+    stmt = select(*LIST_COLUMNS).where(*filters)
+    if min_id is not None:
+        stmt = stmt.where(Tasting.id < min_id)
+    # лишняя строка сверх страницы отвечает «есть ли ещё» тем же запросом
+    stmt = stmt.order_by(Tasting.id.desc()).limit(PAGE_SIZE + 1)
+    async with AsyncSessionLocal() as s:
+        rows = (await s.execute(stmt)).all()
+    page = (rows[:PAGE_SIZE], len(rows) > PAGE_SIZE)
+    if PAGE_EPOCHS.get(uid, 0) == epoch:
+        PAGE_CACHE[key] = page
+    return page
+
+
+async def _prefetch_page(uid: int, kind: str, extra: str, min_id: int) -> None:
+    try:
+        await fetch_tastings_page(uid, kind, extra, min_id=min_id)
+    except Exception:
+        logger.debug("Feed prefetch failed (uid=%s, kind=%s)", uid, kind, exc_info=True)
+
+
+def prefetch_page(uid: int, kind: str, extra: str, min_id: int) -> None:
+    """Греет PAGE_CACHE следующей страницей, пока отправляется текущая."""
+    if (uid, kind, extra, min_id) in PAGE_CACHE:
+        return
+    task = asyncio.create_task(_prefetch_page(uid, kind, extra, min_id))
+    PREFETCH_TASKS.add(task)
+    task.add_done_callback(PREFETCH_TASKS.discard)
+
+
+def invalidate_pages(uid: int) -> None:
+    """Сбрасывает закэшированные страницы ленты пользователя после записи."""
+    PAGE_EPOCHS[uid] = next(_PAGE_EPOCH_SEQ)
+    for key in [key for key in PAGE_CACHE if key[0] == uid]:
+        PAGE_CACHE.pop(key, None)
 
 
 def more_allowed(uid: int) -> bool:
-    now = time.monotonic()
-    last = MORE_THROTTLE.get(uid, 0.0)
-    if now - last < MORE_THROTTLE_INTERVAL:
-        return False
-    MORE_THROTTLE[uid] = now
-    return True
+    return MORE_LIMITER.allow(uid)
+
+
+async def send_rows(message: Message, rows: Sequence[Row]) -> None:
+    """Строки страницы уходят по порядку; параллельны только разные чаты."""
+    # тексты и разметку готовим заранее, до первой отправки
+    payloads = [(short_row(t), open_btn_markup(t.id)) for t in rows]
+    for text, markup in payloads:
+        await CHAT_SEND_LIMITER.acquire(message.chat.id)
+        await BOT_SEND_LIMITER.acquire(None)
+        async with SEND_SEMAPHORE:
+            await message.answer(text, reply_markup=markup)
+
+
+async def emit_rows(
+    message: Message,
+    rows: Sequence[Row],
+    has_more: bool,
+    kind: str,
+    extra: str,
+    uid: int,
+    skip_first: bool = False,
+) -> None:
+    """Страница ленты и, если есть продолжение, кнопка «Показать ещё».
+
+    skip_first — первая строка уже показана (вписана в прежнее сообщение).
+    """
+    await send_rows(message, rows[1:] if skip_first else rows)
+    if has_more:
+        await message.answer(
+            "Показать ещё:",
+            reply_markup=more_btn_kb(
+                kind, save_cursor(uid, kind, extra, rows[-1].id)
+            ).as_markup(),
+        )
 
 
 async def find_cb(call: CallbackQuery):
     await ui(
         call,
         "Выбери способ поиска:",
-        reply_markup=search_menu_kb().as_markup(),
+        reply_markup=SEARCH_MENU_KB,
     )
     await call.answer()
 
@@ -2397,121 +2596,103 @@ async def find_cb(call: CallbackQuery):
 async def find_cmd(message: Message):
     await message.answer(
         "Выбери способ поиска:",
-        reply_markup=search_menu_kb().as_markup(),
+        reply_markup=SEARCH_MENU_KB,
     )
 
 
 async def s_last(call: CallbackQuery):
     uid = call.from_user.id
-    rows, has_more = fetch_tastings_page(uid, "last", "")
+    rows, has_more = await fetch_tastings_page(uid, "last", "")
 
     if not rows:
         await call.message.answer(
-            "Пока пусто.", reply_markup=search_menu_kb().as_markup()
+            "Пока пусто.", reply_markup=SEARCH_MENU_KB
         )
         await call.answer()
         return
 
     await call.message.answer("Последние записи:")
-    for t in rows:
-        await call.message.answer(
-            short_row(t),
-            reply_markup=open_btn_kb(t.id).as_markup(),
-        )
-
-    if has_more:
-        payload = encode_more_payload(uid, rows[-1].id)
-        await call.message.answer(
-            "Показать ещё:",
-            reply_markup=more_btn_kb("last", payload).as_markup(),
-        )
+    await emit_rows(call.message, rows, has_more, "last", "", uid)
 
     await call.message.answer(
-        "Ещё варианты:", reply_markup=search_menu_kb().as_markup()
+        "Ещё варианты:", reply_markup=SEARCH_MENU_KB
     )
     await call.answer()
 
 
 async def last_cmd(message: Message):
     uid = message.from_user.id
-    rows, has_more = fetch_tastings_page(uid, "last", "")
+    rows, has_more = await fetch_tastings_page(uid, "last", "")
 
     if not rows:
         await message.answer(
-            "Пока пусто.", reply_markup=search_menu_kb().as_markup()
+            "Пока пусто.", reply_markup=SEARCH_MENU_KB
         )
         return
 
     await message.answer("Последние записи:")
-    for t in rows:
-        await message.answer(
-            short_row(t),
-            reply_markup=open_btn_kb(t.id).as_markup(),
-        )
-
-    if has_more:
-        payload = encode_more_payload(uid, rows[-1].id)
-        await message.answer(
-            "Показать ещё:",
-            reply_markup=more_btn_kb("last", payload).as_markup(),
-        )
+    await emit_rows(message, rows, has_more, "last", "", uid)
 
     await message.answer(
-        "Ещё варианты:", reply_markup=search_menu_kb().as_markup()
+        "Ещё варианты:", reply_markup=SEARCH_MENU_KB
     )
 
 
-async def more_last(call: CallbackQuery):
-    _, _, payload = call.data.split(":", 2)
-    try:
-        uid_payload, cursor, extra = decode_more_payload(payload)
-    except Exception:
-        await call.answer()
-        return
+# вид ленты -> что ответить, когда страницы кончились
+MORE_EMPTY_TEXT = {"last": "Больше записей нет."}
+
 
-    if uid_payload != call.from_user.id:
+async def more_page(call: CallbackQuery):
+    """Следующая страница любой ленты: вид берётся из more:<kind>:<token>."""
+    _, kind, token = call.data.split(":", 2)
+    uid = call.from_user.id
+    found = load_cursor(token, uid, kind)
+    if found is None:
         try:
             await call.message.edit_reply_markup()
         except TelegramBadRequest:
             pass
         await call.message.answer(
             "Контекст поиска устарел. Запусти поиск заново.",
-            reply_markup=search_menu_kb().as_markup(),
+            reply_markup=SEARCH_MENU_KB,
         )
         await call.answer()
         return
+    extra, cursor = found
 
-    if not more_allowed(call.from_user.id):
+    if not more_allowed(uid):
         await call.answer("Слишком часто. Подожди секунду.")
         return
 
-    rows, has_more = fetch_tastings_page(call.from_user.id, "last", extra, min_id=cursor)
-
-    try:
-        await call.message.edit_reply_markup()
-    except TelegramBadRequest:
-        pass
+    rows, has_more = await fetch_tastings_page(uid, kind, extra, min_id=cursor)
+    if has_more:
+        prefetch_page(uid, kind, extra, rows[-1].id)
 
     if not rows:
+        with suppress(TelegramBadRequest):
+            await call.message.edit_reply_markup()
         await call.message.answer(
-            "Больше записей нет.", reply_markup=search_menu_kb().as_markup()
+            MORE_EMPTY_TEXT.get(kind, "Больше результатов нет."),
+            reply_markup=SEARCH_MENU_KB,
         )
         await call.answer()
         return
 
-    for t in rows:
-        await call.message.answer(
-            short_row(t),
-            reply_markup=open_btn_kb(t.id).as_markup(),
-        )
-
-    if has_more:
-        payload2 = encode_more_payload(call.from_user.id, rows[-1].id, extra)
-        await call.message.answer(
-            "Показать ещё:",
-            reply_markup=more_btn_kb("last", payload2).as_markup(),
+    # сообщение «Показать ещё» превращается в первую строку страницы:
+    # один запрос вместо снятия кнопки и отдельной отправки
+    try:
+        await call.message.edit_text(
+            short_row(rows[0]), reply_markup=open_btn_markup(rows[0].id)
         )
+        first_shown = True
+    except TelegramBadRequest:
+        with suppress(TelegramBadRequest):
+            await call.message.edit_reply_markup()
+        first_shown = False
 
+    await emit_rows(
+        call.message, rows, has_more, kind, extra, uid, skip_first=first_shown
+    )
     await call.answer()
 
 
@@ -2524,97 +2705,26 @@ async def s_name(call: CallbackQuery, state: FSMContext):
 
 
 async def s_name_run(message: Message, state: FSMContext):
-    q = message.text.strip()
+    q = (message.text or "").strip()
     uid = message.from_user.id
-    rows, has_more = fetch_tastings_page(uid, "name", q)
+    rows, has_more = await fetch_tastings_page(uid, "name", q)
 
     await state.clear()
 
     if not rows:
         await message.answer(
             "Ничего не нашёл.",
-            reply_markup=search_menu_kb().as_markup(),
+            reply_markup=SEARCH_MENU_KB,
         )
         return
 
     await message.answer("Найдено:")
-    for t in rows:
-        await message.answer(
-            short_row(t),
-            reply_markup=open_btn_kb(t.id).as_markup(),
-        )
-
-    if has_more:
-        await message.answer(
-            "Показать ещё:",
-            reply_markup=more_btn_kb(
-                "name", encode_more_payload(uid, rows[-1].id, q)
-            ).as_markup(),
-        )
+    await emit_rows(message, rows, has_more, "name", q, uid)
 
     await message.answer(
-        "Ещё варианты:", reply_markup=search_menu_kb().as_markup()
-    )
-
-
-async def more_name(call: CallbackQuery):
-    _, _, payload = call.data.split(":", 2)
-    try:
-        uid_payload, cursor, extra = decode_more_payload(payload)
-    except Exception:
-        await call.answer()
-        return
-
-    if uid_payload != call.from_user.id:
-        try:
-            await call.message.edit_reply_markup()
-        except TelegramBadRequest:
-            pass
-        await call.message.answer(
-            "Контекст поиска устарел. Запусти поиск заново.",
-            reply_markup=search_menu_kb().as_markup(),
-        )
-        await call.answer()
-        return
-
-    if not more_allowed(call.from_user.id):
-        await call.answer("Слишком часто. Подожди секунду.")
-        return
-
-    rows, has_more = fetch_tastings_page(
-        call.from_user.id, "name", extra, min_id=cursor
+        "Ещё варианты:", reply_markup=SEARCH_MENU_KB
     )
 
-    try:
-        await call.message.edit_reply_markup()
-    except TelegramBadRequest:
-        pass
-
-    if not rows:
-        await call.message.answer(
-            "Больше результатов нет.",
-            reply_markup=search_menu_kb().as_markup(),
-        )
-        await call.answer()
-        return
-
-    for t in rows:
-        await call.message.answer(
-            short_row(t),
-            reply_markup=open_btn_kb(t.id).as_markup(),
-        )
-
-    if has_more:
-        await call.message.answer(
-            "Показать ещё:",
-            reply_markup=more_btn_kb(
-                "name",
-                encode_more_payload(call.from_user.id, rows[-1].id, extra),
-            ).as_markup(),
-        )
-
-    await call.answer()
-
 
 # --- поиск по категории
 
@@ -2622,7 +2732,7 @@ async def s_cat(call: CallbackQuery, state: FSMContext):
     await ui(
         call,
         "Выбери категорию или укажи вручную:",
-        reply_markup=category_search_kb().as_markup(),
+        reply_markup=CATEGORY_SEARCH_KB,
     )
     await state.clear()
     await call.answer()
@@ -2637,104 +2747,33 @@ async def s_cat_pick(call: CallbackQuery):
         await call.answer()
         return
 
-    rows, has_more = fetch_tastings_page(uid, "cat", val)
+    rows, has_more = await fetch_tastings_page(uid, "cat", val)
 
     if not rows:
         await call.message.answer(
             "Ничего не нашёл.",
-            reply_markup=search_menu_kb().as_markup(),
+            reply_markup=SEARCH_MENU_KB,
         )
         await call.answer()
         return
 
     await call.message.answer(f"Найдено по категории «{val}»:")
-    for t in rows:
-        await call.message.answer(short_row(t), reply_markup=open_btn_kb(t.id).as_markup())
-
-    if has_more:
-        await call.message.answer(
-            "Показать ещё:",
-            reply_markup=more_btn_kb(
-                "cat", encode_more_payload(uid, rows[-1].id, val)
-            ).as_markup(),
-        )
+    await emit_rows(call.message, rows, has_more, "cat", val, uid)
     await call.answer()
 
 
-async def s_cat_text(message: Message, state: FSMContext):
-    q = (message.text or "").strip()
-    uid = message.from_user.id
-
-    rows, has_more = fetch_tastings_page(uid, "cat", q)
-
-    if not rows:
-        await message.answer("Ничего не нашёл.", reply_markup=search_menu_kb().as_markup())
-        return
-
-    await message.answer(f"Найдено по категории «{q}»:")
-    for t in rows:
-        await message.answer(short_row(t), reply_markup=open_btn_kb(t.id).as_markup())
-
-    if has_more:
-        await message.answer(
-            "Показать ещё:",
-            reply_markup=more_btn_kb(
-                "cat", encode_more_payload(uid, rows[-1].id, q)
-            ).as_markup(),
-        )
-
-
-async def more_cat(call: CallbackQuery):
-    _, _, payload = call.data.split(":", 2)
-    try:
-        uid_payload, cursor, extra = decode_more_payload(payload)
-    except Exception:
-        await call.answer()
-        return
-
-    if uid_payload != call.from_user.id:
-        try:
-            await call.message.edit_reply_markup()
-        except TelegramBadRequest:
-            pass
-        await call.message.answer(
-            "Контекст поиска устарел. Запусти поиск заново.",
-            reply_markup=search_menu_kb().as_markup(),
-        )
-        await call.answer()
-        return
-
-    if not more_allowed(call.from_user.id):
-        await call.answer("Слишком часто. Подожди секунду.")
-        return
-
-    rows, has_more = fetch_tastings_page(
-        call.from_user.id, "cat", extra, min_id=cursor
-    )
+async def s_cat_text(message: Message, state: FSMContext):
+    q = (message.text or "").strip()
+    uid = message.from_user.id
 
-    try:
-        await call.message.edit_reply_markup()
-    except TelegramBadRequest:
-        pass
+    rows, has_more = await fetch_tastings_page(uid, "cat", q)
 
     if not rows:
-        await call.message.answer(
-            "Больше результатов нет.", reply_markup=search_menu_kb().as_markup()
-        )
-        await call.answer()
+        await message.answer("Ничего не нашёл.", reply_markup=SEARCH_MENU_KB)
         return
 
-    for t in rows:
-        await call.message.answer(short_row(t), reply_markup=open_btn_kb(t.id).as_markup())
-
-    if has_more:
-        await call.message.answer(
-            "Показать ещё:",
-            reply_markup=more_btn_kb(
-                "cat", encode_more_payload(call.from_user.id, rows[-1].id, extra)
-            ).as_markup(),
-        )
-    await call.answer()
+    await message.answer(f"Найдено по категории «{q}»:")
+    await emit_rows(message, rows, has_more, "cat", q, uid)
 
 
 # --- поиск по году
@@ -2751,87 +2790,26 @@ async def s_year(call: CallbackQuery, state: FSMContext):
 async def s_year_run(message: Message, state: FSMContext):
     txt = (message.text or "").strip()
     if not txt.isdigit():
-        await message.answer("Нужно число, например 2020.", reply_markup=search_menu_kb().as_markup())
+        await message.answer("Нужно число, например 2020.", reply_markup=SEARCH_MENU_KB)
         await state.clear()
         return
     year = int(txt)
     uid = message.from_user.id
-    rows, has_more = fetch_tastings_page(uid, "year", str(year))
+    rows, has_more = await fetch_tastings_page(uid, "year", str(year))
     await state.clear()
 
     if not rows:
-        await message.answer("Ничего не нашёл.", reply_markup=search_menu_kb().as_markup())
+        await message.answer("Ничего не нашёл.", reply_markup=SEARCH_MENU_KB)
         return
 
     await message.answer(f"Найдено за {year}:")
-    for t in rows:
-        await message.answer(short_row(t), reply_markup=open_btn_kb(t.id).as_markup())
-
-    if has_more:
-        await message.answer(
-            "Показать ещё:",
-            reply_markup=more_btn_kb(
-                "year", encode_more_payload(uid, rows[-1].id, str(year))
-            ).as_markup(),
-        )
-
-
-async def more_year(call: CallbackQuery):
-    _, _, payload = call.data.split(":", 2)
-    try:
-        uid_payload, cursor, extra = decode_more_payload(payload)
-    except Exception:
-        await call.answer()
-        return
-
-    if uid_payload != call.from_user.id:
-        try:
-            await call.message.edit_reply_markup()
-        except TelegramBadRequest:
-            pass
-        await call.message.answer(
-            "Контекст поиска устарел. Запусти поиск заново.",
-            reply_markup=search_menu_kb().as_markup(),
-        )
-        await call.answer()
-        return
-
-    if not more_allowed(call.from_user.id):
-        await call.answer("Слишком часто. Подожди секунду.")
-        return
-
-    rows, has_more = fetch_tastings_page(
-        call.from_user.id, "year", extra, min_id=cursor
-    )
-
-    try:
-        await call.message.edit_reply_markup()
-    except TelegramBadRequest:
-        pass
-
-    if not rows:
-        await call.message.answer("Больше результатов нет.", reply_markup=search_menu_kb().as_markup())
-        await call.answer()
-        return
-
-    for t in rows:
-        await call.message.answer(short_row(t), reply_markup=open_btn_kb(t.id).as_markup())
-
-    if has_more:
-        await call.message.answer(
-            "Показать ещё:",
-            reply_markup=more_btn_kb(
-                "year",
-                encode_more_payload(call.from_user.id, rows[-1].id, extra),
-            ).as_markup(),
-        )
-    await call.answer()
+    await emit_rows(message, rows, has_more, "year", str(year), uid)
 
 
 # --- поиск по рейтингу (не ниже X)
 
 async def s_rating(call: CallbackQuery):
-    await ui(call, "Минимальная оценка?", reply_markup=rating_filter_kb().as_markup())
+    await ui(call, "Минимальная оценка?", reply_markup=RATING_FILTER_KB)
     await call.answer()
 
 
@@ -2844,75 +2822,15 @@ async def rating_filter_pick(call: CallbackQuery):
         return
 
     uid = call.from_user.id
-    rows, has_more = fetch_tastings_page(uid, "rating", str(thr))
+    rows, has_more = await fetch_tastings_page(uid, "rating", str(thr))
 
     if not rows:
-        await call.message.answer("Ничего не нашёл.", reply_markup=search_menu_kb().as_markup())
+        await call.message.answer("Ничего не нашёл.", reply_markup=SEARCH_MENU_KB)
         await call.answer()
         return
 
     await call.message.answer(f"Найдено с оценкой ≥ {thr}:")
-    for t in rows:
-        await call.message.answer(short_row(t), reply_markup=open_btn_kb(t.id).as_markup())
-
-    if has_more:
-        await call.message.answer(
-            "Показать ещё:",
-            reply_markup=more_btn_kb(
-                "rating", encode_more_payload(uid, rows[-1].id, str(thr))
-            ).as_markup(),
-        )
-    await call.answer()
-
-
-async def more_rating(call: CallbackQuery):
-    _, _, payload = call.data.split(":", 2)
-    try:
-        uid_payload, cursor, extra = decode_more_payload(payload)
-    except Exception:
-        await call.answer()
-        return
-
-    if uid_payload != call.from_user.id:
-        try:
-            await call.message.edit_reply_markup()
-        except TelegramBadRequest:
-            pass
-        await call.message.answer(
-            "Контекст поиска устарел. Запусти поиск заново.",
-            reply_markup=search_menu_kb().as_markup(),
-        )
-        await call.answer()
-        return
-
-    if not more_allowed(call.from_user.id):
-        await call.answer("Слишком часто. Подожди секунду.")
-        return
-
-    rows, has_more = fetch_tastings_page(
-        call.from_user.id, "rating", extra, min_id=cursor
-    )
-
-    try:
-        await call.message.edit_reply_markup()
-    except TelegramBadRequest:
-        pass
-
-    if not rows:
-        await call.message.answer("Больше результатов нет.", reply_markup=search_menu_kb().as_markup())
-        await call.answer()
-        return
-
-    for t in rows:
-        await call.message.answer(short_row(t), reply_markup=open_btn_kb(t.id).as_markup())
-
-    if has_more:
-        await call.message.answer(
-            "Показать ещё:",
-            reply_markup=more_btn_kb(
-                "rating", encode_more_payload(call.from_user.id, rows[-1].id, extra)
-            ).as_markup(),
-        )
+    await emit_rows(call.message, rows, has_more, "rating", str(thr), uid)
     await call.answer()
 
 
@@ -2926,51 +2844,35 @@ async def open_card(call: CallbackQuery):
         await call.answer()
         return
 
-    with SessionLocal() as s:
-        t = s.get(Tasting, tid)
-        if not t or t.user_id != call.from_user.id:
-            await call.message.answer("Запись не найдена.")
-            await call.answer()
-            return
+    # карточка, проливы и фото — одним запросом к tastings плюс два selectin
+    stmt = (
+        select(Tasting)
+        .options(selectinload(Tasting.infusions), selectinload(Tasting.photos))
+        .where(Tasting.id == tid, Tasting.user_id == call.from_user.id)
+    )
+    async with AsyncSessionLocal() as s:
+        t = (await s.execute(stmt)).scalar_one_or_none()
+    if t is None:
+        await call.message.answer("Запись не найдена.")
+        await call.answer()
+        return
 
-        inf_list = (
-            s.execute(
-                select(Infusion)
-                .where(Infusion.tasting_id == tid)
-                .order_by(Infusion.n)
-            )
-            .scalars()
-            .all()
-        )
-        infusions_data = [
-            {
-                "n": inf.n,
-                "seconds": inf.seconds,
-                "liquor_color": inf.liquor_color,
-                "taste": inf.taste,
-                "special_notes": inf.special_notes,
-                "body": inf.body,
-                "aftertaste": inf.aftertaste,
-            }
-            for inf in inf_list
-        ]
-
-        photo_count = (
-            s.execute(
-                select(func.count(Photo.id)).where(Photo.tasting_id == tid)
-            )
-            .scalar_one()
-        )
-        photo_ids = (
-            s.execute(
-                select(func.coalesce(Photo.telegram_file_id, Photo.file_id))
-                .where(Photo.tasting_id == tid)
-                .order_by(Photo.id.asc())
-                .limit(MAX_PHOTOS)
-            )
-            .scalars()
-            .all()
-        )
+    infusions_data = [
+        {
+            "n": inf.n,
+            "seconds": inf.seconds,
+            "liquor_color": inf.liquor_color,
+            "taste": inf.taste,
+            "special_notes": inf.special_notes,
+            "body": inf.body,
+            "aftertaste": inf.aftertaste,
+        }
+        for inf in sorted(t.infusions, key=lambda inf: inf.n)
+    ]
+    # фото на запись не больше MAX_PHOTOS, так что грузить их целиком дёшево
+    photos = sorted(t.photos, key=lambda p: p.id)
+    photo_count = len(photos)
+    photo_ids = [p.telegram_file_id or p.file_id for p in photos[:MAX_PHOTOS]]
 
     card_text = build_card_text(
         t, infusions_data, photo_count=photo_count or 0
@@ -2980,17 +2882,11 @@ async def open_card(call: CallbackQuery):
         t.id,
         card_text,
         photo_ids,
-        reply_markup=card_actions_kb(t.id).as_markup(),
+        reply_markup=card_actions_markup(t.id),
     )
     await call.answer()
 
 
-def edit_context_home_markup() -> InlineKeyboardMarkup:
-    kb = InlineKeyboardMarkup()
-    kb.add(InlineKeyboardButton("⬅️ В меню", callback_data="nav:home"))
-    return kb
-
-
 async def notify_edit_context_lost(event: Union[CallbackQuery, Message], state: FSMContext):
     data = await state.get_data()
     if data.get("edit_ctx_warned"):
@@ -2998,11 +2894,29 @@ async def notify_edit_context_lost(event: Union[CallbackQuery, Message], state:
     await ui(
         event,
         "Контекст редактирования потерян.",
-        reply_markup=edit_context_home_markup(),
+        reply_markup=EDIT_HOME_KB,
     )
     await state.update_data(edit_ctx_warned=True)
 
 
+# (tid, uid) -> владеет ли; шаги одного редактирования не ходят в БД повторно
+OWNERSHIP_CACHE: "TTLCache[Tuple[int, int], bool]" = TTLCache(maxsize=4096, ttl=30)
+
+
+async def _owns(tid: int, uid: int) -> bool:
+    """Запись tid принадлежит uid — без загрузки самой строки."""
+    stmt = select(1).where(Tasting.id == tid, Tasting.user_id == uid).limit(1)
+    async with AsyncSessionLocal() as s:
+        return (await s.execute(stmt)).scalar() is not None
+
+
+async def _owned_seq_no(tid: int, uid: int) -> Optional[int]:
+    """Номер записи tid, если она принадлежит uid, иначе None."""
+    stmt = select(Tasting.seq_no).where(Tasting.id == tid, Tasting.user_id == uid)
+    async with AsyncSessionLocal() as s:
+        return (await s.execute(stmt)).scalar_one_or_none()
+
+
 async def ensure_edit_context(event: Union[CallbackQuery, Message], state: FSMContext):
     """
     Проверяет валидность контекста редактирования.
@@ -3046,12 +2960,13 @@ async def ensure_edit_context(event: Union[CallbackQuery, Message], state: FSMCo
         return None
 
     try:
-        with SessionLocal() as s:
-            t = s.get(Tasting, tid)
-            if not t or t.user_id != uid:
-                logger.warning("Edit context invalid owner (tid=%s, uid=%s)", tid, uid)
-                await notify_edit_context_lost(event, state)
-                return None
+        owned = OWNERSHIP_CACHE.get((tid, uid))
+        if owned is None:
+            owned = OWNERSHIP_CACHE[(tid, uid)] = await _owns(tid, uid)
+        if not owned:
+            logger.warning("Edit context invalid owner (tid=%s, uid=%s)", tid, uid)
+            await notify_edit_context_lost(event, state)
+            return None
     except Exception:
         logger.exception("Failed to verify edit context (tid=%s)", tid)
         await notify_edit_context_lost(event, state)
@@ -3063,69 +2978,97 @@ async def ensure_edit_context(event: Union[CallbackQuery, Message], state: FSMCo
     return {"tid": tid, "field": field, "seq_no": seq_no}
 
 
-def prepare_text_edit(field: str, raw: str) -> Tuple[Optional[Union[str, int, float]], Optional[str], Optional[str]]:
-    cfg = EDIT_TEXT_FIELDS[field]
-    text = (raw or "").strip()
-    if not text:
-        return None, cfg["prompt"], None
+EditResult = Tuple[Optional[Union[str, int, float]], Optional[str], Optional[str]]
 
-    if text == "-":
-        if cfg["allow_clear"]:
-            return None, None, cfg["column"]
-        return None, cfg["prompt"], None
-
-    if field == "name":
-        if text == "-":
-            return None, cfg["prompt"], None
-        return text, None, cfg["column"]
-    if field == "year":
-        try:
-            value = parse_year_value(text)
-        except ValueError as exc:
-            return None, f"{exc} {cfg['prompt']}", None
-        return value, None, cfg["column"]
-    if field == "grams":
-        try:
-            value = parse_grams_value(text)
-        except ValueError as exc:
-            return None, f"{exc} {cfg['prompt']}", None
-        return value, None, cfg["column"]
-    if field == "temp_c":
+
+def _edit_text(text: str, prompt: str, column: str) -> EditResult:
+    return text, None, column
+
+
+EditParser = Callable[[str, str, str], EditResult]
+
+
+def _edit_number(parse: Callable[[str], Union[int, float]]) -> EditParser:
+    def parser(text: str, prompt: str, column: str) -> EditResult:
         try:
-            value = parse_temp_value(text)
+            value = parse(text)
         except ValueError as exc:
-            return None, f"{exc} {cfg['prompt']}", None
-        return value, None, cfg["column"]
-    if field == "tasted_at":
-        try:
-            datetime.datetime.strptime(text, "%H:%M")
-        except ValueError:
-            return None, "Время должно быть в формате HH:MM. " + cfg["prompt"], None
-        return text, None, cfg["column"]
-    if field in {"effects", "scenarios"}:
-        normalized = normalize_csv_text(text)
-        if not normalized:
-            return None, cfg["prompt"], None
-        return normalized, None, cfg["column"]
-    # остальные текстовые поля — просто сохраняем строку
-    return text, None, cfg["column"]
-
-
-def update_tasting_fields(tid: int, uid: int, **updates) -> bool:
+            return None, f"{exc} {prompt}", None
+        return value, None, column
+
+    return parser
+
+
+def _valid_hhmm(text: str) -> bool:
+    """Время HH:MM; как и strptime("%H:%M"), допускает одну цифру в части."""
+    hh, sep, mm = text.partition(":")
+    # isdecimal() пропускает и не-ASCII цифры («١٢»), strptime — нет
+    return (
+        bool(sep)
+        and text.isascii()
+        and 0 < len(hh) <= 2
+        and 0 < len(mm) <= 2
+        and hh.isdecimal()
+        and mm.isdecimal()
+        and int(hh) < 24
+        and int(mm) < 60
+    )
+
+
+def _edit_time(text: str, prompt: str, column: str) -> EditResult:
+    if not _valid_hhmm(text):
+        return None, "Время должно быть в формате HH:MM. " + prompt, None
+    return text, None, column
+
+
+def _edit_csv(text: str, prompt: str, column: str) -> EditResult:
+    normalized = normalize_csv_text(text)
+    if not normalized:
+        return None, prompt, None
+    return normalized, None, column
+
+
+# поле -> разбор введённого текста; остальные поля сохраняются строкой как есть
+EDIT_PARSERS: Dict[str, EditParser] = {
+    "year": _edit_number(parse_year_value),
+    "grams": _edit_number(parse_grams_value),
+    "temp_c": _edit_number(parse_temp_value),
+    "tasted_at": _edit_time,
+    "effects": _edit_csv,
+    "scenarios": _edit_csv,
+}
+
+
+def prepare_text_edit(field: str, raw: str) -> EditResult:
+    prompt, allow_clear, column = EDIT_TEXT_FIELDS[field]
+    text = (raw or "").strip()
+    if not text:
+        return None, prompt, None
+    if text == "-":
+        return (None, None, column) if allow_clear else (None, prompt, None)
+    return EDIT_PARSERS.get(field, _edit_text)(text, prompt, column)
+
+
+async def update_tasting_fields(tid: int, uid: int, **updates) -> bool:
     if not updates:
         return False
-    with SessionLocal() as s:
-        t = s.get(Tasting, tid)
-        if not t or t.user_id != uid:
-            return False
-        for key, value in updates.items():
-            setattr(t, key, value)
-        s.commit()
-    return True
+    # владелец проверяется тем же UPDATE: чужая запись даст rowcount 0;
+    # updated_at проставляет onupdate колонки
+    stmt = (
+        update(Tasting)
+        .where(Tasting.id == tid, Tasting.user_id == uid)
+        .values(**updates)
+    )
+    async with AsyncSessionLocal() as s:
+        updated = (await s.execute(stmt)).rowcount > 0
+        await s.commit()
+    if updated:
+        invalidate_pages(uid)
+    return updated
 
 
 async def send_edit_menu(target: Union[CallbackQuery, Message], seq_no: int):
-    markup = edit_fields_kb().as_markup()
+    markup = EDIT_FIELDS_KB
     text = edit_menu_text(seq_no)
     if isinstance(target, CallbackQuery):
         await target.message.answer(text, reply_markup=markup)
@@ -3147,13 +3090,11 @@ async def edit_cb(call: CallbackQuery, state: FSMContext):
         return
 
     try:
-        with SessionLocal() as s:
-            t = s.get(Tasting, tid)
-            if not t or t.user_id != call.from_user.id:
-                await call.message.answer("Нет доступа к этой записи.")
-                await call.answer()
-                return
-            seq_no = t.seq_no
+        seq_no = await _owned_seq_no(tid, call.from_user.id)
+        if seq_no is None:
+            await call.message.answer("Нет доступа к этой записи.")
+            await call.answer()
+            return
 
         await state.clear()
         await state.set_state(EditFlow.choosing)
@@ -3179,35 +3120,40 @@ async def del_cb(call: CallbackQuery):
     except Exception:
         await call.answer()
         return
-    with SessionLocal() as s:
-        t = s.get(Tasting, tid)
-        if not t or t.user_id != call.from_user.id:
-            await call.message.answer("Нет доступа к этой записи.")
-            await call.answer()
-            return
+    seq_no = await _owned_seq_no(tid, call.from_user.id)
+    if seq_no is None:
+        await call.message.answer("Нет доступа к этой записи.")
+        await call.answer()
+        return
     await call.message.answer(
-        f"Удалить #{t.seq_no}?",
-        reply_markup=confirm_del_kb(tid).as_markup(),
+        f"Удалить #{seq_no}?",
+        reply_markup=confirm_del_markup(tid, seq_no),
     )
     await call.answer()
 
 
 async def del_ok_cb(call: CallbackQuery):
+    # delok:<tid>:<seq_no>; у кнопок старого формата номера нет
+    _, sid, *rest = call.data.split(":", 2)
     try:
-        _, sid = call.data.split(":", 1)
         tid = int(sid)
-    except Exception:
+    except ValueError:
         await call.answer()
         return
-    with SessionLocal() as s:
-        t = s.get(Tasting, tid)
-        if not t or t.user_id != call.from_user.id:
-            await call.message.answer("Нет доступа к этой записи.")
-            await call.answer()
-            return
-        s.delete(t)
-        s.commit()
-    await call.message.answer(f"Удалил #{t.seq_no}.")
+    # проливы и фото удаляет ON DELETE CASCADE
+    stmt = delete(Tasting).where(
+        Tasting.id == tid, Tasting.user_id == call.from_user.id
+    )
+    async with AsyncSessionLocal() as s:
+        deleted = (await s.execute(stmt)).rowcount > 0
+        await s.commit()
+    if not deleted:
+        await call.message.answer("Нет доступа к этой записи.")
+        await call.answer()
+        return
+    OWNERSHIP_CACHE.pop((tid, call.from_user.id), None)
+    invalidate_pages(call.from_user.id)
+    await call.message.answer(f"Удалил #{rest[0]}." if rest else "Удалил запись.")
     await call.answer()
 
 
@@ -3250,7 +3196,7 @@ async def edit_field_select(call: CallbackQuery, state: FSMContext):
                 edit_ctx_warned=False,
             )
             await call.message.answer(
-                "Выбери категорию:", reply_markup=edit_category_kb().as_markup()
+                "Выбери категорию:", reply_markup=EDIT_CATEGORY_KB
             )
             await call.answer()
             return
@@ -3258,7 +3204,7 @@ async def edit_field_select(call: CallbackQuery, state: FSMContext):
         if field == "rating":
             await state.update_data(edit_field="rating", edit_ctx_warned=False)
             await call.message.answer(
-                "Выбери оценку:", reply_markup=edit_rating_kb().as_markup()
+                "Выбери оценку:", reply_markup=EDIT_RATING_KB
             )
             await call.answer()
             return
@@ -3267,14 +3213,14 @@ async def edit_field_select(call: CallbackQuery, state: FSMContext):
             await call.answer()
             return
 
-        cfg = EDIT_TEXT_FIELDS[field]
+        prompt = EDIT_TEXT_FIELDS[field][0]
         await state.update_data(
             edit_field=field,
             awaiting_category_text=False,
             edit_ctx_warned=False,
         )
         await state.set_state(EditFlow.waiting_text)
-        await call.message.answer(cfg["prompt"])
+        await call.message.answer(prompt)
         await call.answer()
     except Exception:
         logger.exception("edit flow failed")
@@ -3333,7 +3279,7 @@ async def edit_category_pick(call: CallbackQuery, state: FSMContext):
             await call.answer()
             return
 
-        ok = update_tasting_fields(tid, call.from_user.id, category=raw)
+        ok = await update_tasting_fields(tid, call.from_user.id, category=raw)
         if not ok:
             logger.warning("Failed to update category for tasting %s", tid)
             await notify_edit_context_lost(call, state)
@@ -3380,7 +3326,7 @@ async def edit_rating_pick(call: CallbackQuery, state: FSMContext):
         return
 
     try:
-        ok = update_tasting_fields(tid, call.from_user.id, rating=rating)
+        ok = await update_tasting_fields(tid, call.from_user.id, rating=rating)
         if not ok:
             logger.warning("Failed to update rating for tasting %s", tid)
             await notify_edit_context_lost(call, state)
@@ -3430,7 +3376,7 @@ async def edit_flow_msg(message: Message, state: FSMContext):
                     "Категория слишком длинная. Пришли категорию текстом покороче."
                 )
                 return
-            ok = update_tasting_fields(tid, message.from_user.id, category=txt)
+            ok = await update_tasting_fields(tid, message.from_user.id, category=txt)
             if not ok:
                 logger.warning("Failed to update category text for tasting %s", tid)
                 await notify_edit_context_lost(message, state)
@@ -3455,7 +3401,7 @@ async def edit_flow_msg(message: Message, state: FSMContext):
             return
 
         updates = {column: value}
-        ok = update_tasting_fields(tid, message.from_user.id, **updates)
+        ok = await update_tasting_fields(tid, message.from_user.id, **updates)
         if not ok:
             logger.warning("Failed to update field %s for tasting %s", field, tid)
             await notify_edit_context_lost(message, state)
@@ -3479,7 +3425,7 @@ async def edit_cmd(message: Message, state: FSMContext):
     if len(parts) < 2:
         await message.answer("Использование: /edit <id или #номер>")
         return
-    target = resolve_tasting(message.from_user.id, parts[1])
+    target = await resolve_tasting(message.from_user.id, parts[1])
     if not target:
         await message.answer("Запись не найдена.")
         return
@@ -3500,13 +3446,13 @@ async def delete_cmd(message: Message):
     if len(parts) < 2:
         await message.answer("Использование: /delete <id или #номер>")
         return
-    target = resolve_tasting(message.from_user.id, parts[1])
+    target = await resolve_tasting(message.from_user.id, parts[1])
     if not target:
         await message.answer("Запись не найдена.")
         return
     await message.answer(
         f"Удалить #{target.seq_no}?",
-        reply_markup=confirm_del_kb(target.id).as_markup(),
+        reply_markup=confirm_del_markup(target.id, target.seq_no),
     )
 
 
@@ -3517,7 +3463,7 @@ async def show_main_menu(bot: Bot, chat_id: int):
     await bot.send_message(
         chat_id=chat_id,
         text=caption,
-        reply_markup=main_kb().as_markup(),
+        reply_markup=MAIN_KB,
     )
 
 
@@ -3526,7 +3472,7 @@ async def on_start(message: Message, state: FSMContext):
     await show_main_menu(message.bot, message.chat.id)
 
 
-def help_text(is_admin: bool) -> str:
+def _build_help_text(is_admin: bool) -> str:
     lines = [
         "Команды:",
         "/start — главное меню",
@@ -3551,6 +3497,14 @@ def help_text(is_admin: bool) -> str:
     return "\n".join(lines)
 
 
+# Текст справки зависит только от флагов процесса — собираем оба варианта заранее.
+_HELP_TEXTS = {flag: _build_help_text(flag) for flag in (False, True)}
+
+
+def help_text(is_admin: bool) -> str:
+    return _HELP_TEXTS[bool(is_admin)]
+
+
 def help_markup() -> InlineKeyboardMarkup:
     kb = InlineKeyboardBuilder()
     kb.button(text="◀️ В меню", callback_data="to_menu")
@@ -3558,10 +3512,13 @@ def help_markup() -> InlineKeyboardMarkup:
     return kb.as_markup()
 
 
+HELP_KB = help_markup()
+
+
 async def help_cmd(message: Message):
     uid = getattr(message.from_user, "id", None)
     is_admin = bool(uid in ADMINS)
-    await message.answer(help_text(is_admin), reply_markup=help_markup())
+    await message.answer(help_text(is_admin), reply_markup=HELP_KB)
 
 
 async def cancel_cmd(message: Message, state: FSMContext):
@@ -3569,7 +3526,7 @@ async def cancel_cmd(message: Message, state: FSMContext):
     await state.update_data(numpad_active=False)
     await message.answer(
         "Ок, сбросил. Возвращаю в меню.",
-        reply_markup=main_kb().as_markup(),
+        reply_markup=MAIN_KB,
     )
 
 
@@ -3587,7 +3544,7 @@ async def reset_state_cmd(message: Message, state: FSMContext):
 async def menu_cmd(message: Message):
     await message.answer(
         "Включил кнопки под полем ввода.",
-        reply_markup=reply_main_kb(),
+        reply_markup=REPLY_MAIN_KB,
     )
 
 
@@ -3595,24 +3552,30 @@ async def hide_cmd(message: Message):
     await message.answer("Скрываю кнопки.", reply_markup=ReplyKeyboardRemove())
 
 
+# подпись reply-кнопки (без эмодзи) -> хендлер
+REPLY_ROUTES: Dict[str, Callable[[Message, FSMContext], Awaitable[None]]] = {
+    "Новая дегустация": new_cmd,
+    "Найти записи": lambda message, state: find_cmd(message),
+    "Последние 5": lambda message, state: last_cmd(message),
+    "Помощь": lambda message, state: help_cmd(message),
+    "О боте": lambda message, state: help_cmd(message),
+    "Сброс": cancel_cmd,
+    "Отмена": cancel_cmd,
+}
+
+
 async def reply_buttons_router(message: Message, state: FSMContext):
     t = (message.text or "").strip()
-    if "Новая дегустация" in t:
-        await new_cmd(message, state)
-    elif "Найти записи" in t:
-        await find_cmd(message)
-    elif "Последние 5" in t:
-        await last_cmd(message)
-    elif "Помощь" in t or "О боте" in t:
-        await help_cmd(message)
-    elif t == "Сброс" or t == "Отмена":
-        await cancel_cmd(message, state)
+    # подпись целиком или после эмодзи-префикса («📝 Новая дегустация»)
+    handler = REPLY_ROUTES.get(t) or REPLY_ROUTES.get(t.partition(" ")[2])
+    if handler is not None:
+        await handler(message, state)
 
 
 async def help_cb(call: CallbackQuery):
     uid = getattr(call.from_user, "id", None)
     is_admin = bool(uid in ADMINS)
-    await call.message.answer(help_text(is_admin), reply_markup=help_markup())
+    await call.message.answer(help_text(is_admin), reply_markup=HELP_KB)
     await call.answer()
 
 
@@ -3650,9 +3613,8 @@ async def tz_cmd(message: Message):
     uid = message.from_user.id
 
     if len(parts) == 1:
-        user = get_or_create_user(uid, message.from_user.username)
-        offset_min = user.tz_offset_min or 0
-        current = format_tz_offset(offset_min)
+        # сдвиг из того же кэша, что и для «текущего времени»
+        current = format_tz_offset(await get_user_tz_offset(uid))
         back_markup = InlineKeyboardMarkup(
             inline_keyboard=[
                 [InlineKeyboardButton(text="↩ В меню", callback_data="menu:main")]
@@ -3669,215 +3631,353 @@ async def tz_cmd(message: Message):
         )
         return
 
-    raw = parts[1].strip()
     try:
-        offset_min = parse_tz_offset(raw)
+        # parse_tz_offset сам обрезает пробелы и префикс UTC
+        offset_min = parse_tz_offset(parts[1])
     except ValueError:
         await message.answer(TZ_OFFSET_ERROR)
         return
 
-    set_user_timezone(uid, offset_min)
+    await set_user_timezone(uid, offset_min)
     formatted = format_tz_offset(offset_min)
     await message.answer(
         f"Запомнил {formatted}. Теперь буду подставлять твоё локальное время."
     )
 
 
-# ---------------- РЕГИСТРАЦИЯ ХЭНДЛЕРОВ ----------------
+# ---------------- МАРШРУТЫ CALLBACK ----------------
+
+CallbackHandler = Callable[[CallbackQuery, FSMContext], Awaitable[None]]
+
+
+def _no_state(handler: Callable[[CallbackQuery], Awaitable[None]]) -> CallbackHandler:
+    return lambda call, state: handler(call)
+
+
+# callback_data целиком -> хендлер
+CALLBACK_EXACT: Dict[str, CallbackHandler] = {
+    "new": new_cb,
+    "find": _no_state(find_cb),
+    "help": _no_state(help_cb),
+    "menu:main": _no_state(tz_menu_back),
+    "back:main": _no_state(back_main),
+    "nav:home": nav_home,
+    "to_menu": nav_home,
+    "skip:region": region_skip,
+    "time:now": time_now,
+    "skip:tasted_at": tasted_at_skip,
+    "skip:gear": gear_skip,
+    "skip:color": color_skip,
+    "skip:special": special_skip,
+    "more_inf": more_infusions,
+    "finish_inf": finish_infusions,
+    "skip:summary": summary_skip,
+    "photos:done": photos_done,
+    "skip:photos": photos_skip,
+    "s_last": _no_state(s_last),
+    "s_name": s_name,
+    "s_cat": s_cat,
+    "s_year": s_year,
+    "s_rating": _no_state(s_rating),
+}
 
-def setup_handlers(dp: Dispatcher):
-    if DIAGNOSTICS_ENABLED:
-        dp.include_router(create_router(ADMINS, IS_PROD))
+# префикс до первого «:» -> хендлер
+CALLBACK_PREFIX: Dict[str, CallbackHandler] = {
+    "cat": cat_pick,
+    "scat": _no_state(s_cat_pick),
+    "ad": aroma_dry_toggle,
+    "aw": aroma_warmed_toggle,
+    "taste": taste_toggle,
+    "body": inf_body_pick,
+    "aft": aftertaste_toggle,
+    "eff": eff_toggle_or_done,
+    "scn": scn_toggle_or_done,
+    "rate": rate_pick,
+    "pics": _no_state(show_pics),
+    "frate": _no_state(rating_filter_pick),
+    "more": _no_state(more_page),
+    "efld": edit_field_select,
+    "ecat": edit_category_pick,
+    "erat": edit_rating_pick,
+    "edit": edit_cb,
+    "open": _no_state(open_card),
+    "del": _no_state(del_cb),
+    "delok": _no_state(del_ok_cb),
+    "delno": _no_state(del_no_cb),
+}
 
-    # команды
-    dp.message.register(on_start, CommandStart())
-    dp.message.register(help_cmd, Command("help"))
-    dp.message.register(cancel_cmd, Command("cancel"))
-    dp.message.register(reset_cmd, Command("reset"))
-    dp.message.register(reset_state_cmd, Command("resetstate"))
-    dp.message.register(menu_cmd, Command("menu"))
-    dp.message.register(hide_cmd, Command("hide"))
-    dp.message.register(new_cmd, Command("new"))
-    dp.message.register(find_cmd, Command("find"))
-    dp.message.register(last_cmd, Command("last"))
-    dp.message.register(edit_cmd, Command("edit"))
-    dp.message.register(delete_cmd, Command("delete"))
-    dp.message.register(tz_cmd, Command("tz"))
-
-    # STATE-хендлеры — раньше любых общих
-    dp.message.register(name_in, NewTasting.name)
-    dp.message.register(year_in, NewTasting.year)
-    dp.message.register(region_in, NewTasting.region)
-    dp.message.register(cat_custom_in, NewTasting.category)
-    dp.message.register(grams_in, NewTasting.grams)
-    dp.message.register(temp_in, NewTasting.temp_c)
-    dp.message.register(tasted_at_in, NewTasting.tasted_at)
-    dp.message.register(gear_in, NewTasting.gear)
-    dp.message.register(aroma_dry_custom, NewTasting.aroma_dry)
-    dp.message.register(aroma_warmed_custom, NewTasting.aroma_warmed)
-
-    dp.message.register(inf_seconds, InfusionState.seconds)
-    dp.message.register(inf_color, InfusionState.color)
-    dp.message.register(taste_custom, InfusionState.taste)
-    dp.message.register(inf_taste, InfusionState.taste)
-    dp.message.register(inf_special, InfusionState.special)
-    dp.message.register(inf_body_custom, InfusionState.body)
-    dp.message.register(aftertaste_custom, InfusionState.aftertaste)
-
-    dp.message.register(rating_in, RatingSummary.rating)
-    dp.message.register(summary_in, RatingSummary.summary)
-
-    dp.message.register(eff_custom, EffectsScenarios.effects)
-    dp.message.register(scn_custom, EffectsScenarios.scenarios)
-
-    dp.message.register(photo_add, StateFilter("*"), F.photo)
-
-    # поиск (message)
-    dp.message.register(s_name_run, SearchFlow.name)
-    dp.message.register(s_cat_text, SearchFlow.category)
-    dp.message.register(s_year_run, SearchFlow.year)
-
-    # редактирование записи
-    dp.message.register(edit_flow_msg, EditFlow.waiting_text)
-
-    # reply-кнопки в самом конце!
-    dp.message.register(
-        reply_buttons_router,
-        F.text,
-        lambda m: not (m.text or "").startswith("/"),
-        ~CommandStart(),
-    )
 
-    # callbacks
-    dp.callback_query.register(new_cb, F.data == "new")
-    dp.callback_query.register(find_cb, F.data == "find")
-    dp.callback_query.register(help_cb, F.data == "help")
-    dp.callback_query.register(tz_menu_back, F.data == "menu:main")
-    dp.callback_query.register(back_main, F.data == "back:main")
-    dp.callback_query.register(nav_home, F.data == "nav:home")
-    dp.callback_query.register(nav_home, F.data == "to_menu")
+def callback_route(call: CallbackQuery) -> Union[bool, Dict[str, CallbackHandler]]:
+    """Фильтр: находит хендлер по callback_data и передаёт его как route."""
+    data = call.data or ""
+    handler = CALLBACK_EXACT.get(data)
+    if handler is None:
+        prefix, sep, _ = data.partition(":")
+        if sep:
+            handler = CALLBACK_PREFIX.get(prefix)
+    return {"route": handler} if handler is not None else False
+
 
-    dp.callback_query.register(cat_pick, F.data.startswith("cat:"))
-    dp.callback_query.register(s_cat_pick, F.data.startswith("scat:"))
+async def route_callback(
+    call: CallbackQuery, state: FSMContext, route: CallbackHandler
+) -> None:
+    await route(call, state)
+
+
+# ---------------- РЕГИСТРАЦИЯ ХЭНДЛЕРОВ ----------------
 
-    dp.callback_query.register(
+def commands_router() -> Router:
+    router = Router(name="commands")
+    router.message.register(on_start, CommandStart())
+    router.message.register(help_cmd, Command("help"))
+    router.message.register(cancel_cmd, Command("cancel"))
+    router.message.register(reset_cmd, Command("reset"))
+    router.message.register(reset_state_cmd, Command("resetstate"))
+    router.message.register(menu_cmd, Command("menu"))
+    router.message.register(hide_cmd, Command("hide"))
+    router.message.register(new_cmd, Command("new"))
+    router.message.register(find_cmd, Command("find"))
+    router.message.register(last_cmd, Command("last"))
+    router.message.register(edit_cmd, Command("edit"))
+    router.message.register(delete_cmd, Command("delete"))
+    router.message.register(tz_cmd, Command("tz"))
+    return router
+
+
+def new_tasting_router() -> Router:
+    """Шаги анкеты; вне этих состояний апдейт отсекается фильтром роутера."""
+    router = Router(name="new_tasting")
+    in_flow = StateFilter(NewTasting, InfusionState, RatingSummary, EffectsScenarios)
+    router.message.filter(in_flow)
+    router.callback_query.filter(in_flow)
+
+    router.message.register(name_in, NewTasting.name)
+    router.message.register(year_in, NewTasting.year)
+    router.message.register(region_in, NewTasting.region)
+    router.message.register(cat_custom_in, NewTasting.category)
+    router.message.register(grams_in, NewTasting.grams)
+    router.message.register(temp_in, NewTasting.temp_c)
+    router.message.register(tasted_at_in, NewTasting.tasted_at)
+    router.message.register(gear_in, NewTasting.gear)
+    router.message.register(aroma_dry_custom, NewTasting.aroma_dry)
+    router.message.register(aroma_warmed_custom, NewTasting.aroma_warmed)
+
+    router.message.register(inf_seconds, InfusionState.seconds)
+    router.message.register(inf_color, InfusionState.color)
+    router.message.register(taste_custom, InfusionState.taste)
+    router.message.register(inf_taste, InfusionState.taste)
+    router.message.register(inf_special, InfusionState.special)
+    router.message.register(inf_body_custom, InfusionState.body)
+    router.message.register(aftertaste_custom, InfusionState.aftertaste)
+
+    router.message.register(rating_in, RatingSummary.rating)
+    router.message.register(summary_in, RatingSummary.summary)
+
+    router.message.register(eff_custom, EffectsScenarios.effects)
+    router.message.register(scn_custom, EffectsScenarios.scenarios)
+
+    # пропуски числовых шагов действуют только в своём состоянии
+    router.callback_query.register(
         skip_year_callback, StateFilter(NewTasting.year), F.data == "skip:year"
     )
-    dp.callback_query.register(
+    router.callback_query.register(
         skip_grams_callback, StateFilter(NewTasting.grams), F.data == "skip:grams"
     )
-    dp.callback_query.register(
+    router.callback_query.register(
         skip_temp_callback, StateFilter(NewTasting.temp_c), F.data == "skip:temp"
     )
-    dp.callback_query.register(
+    router.callback_query.register(
         inf_seconds_skip,
         StateFilter(InfusionState.seconds),
         F.data == "skip:infsec",
     )
-    dp.callback_query.register(region_skip, F.data == "skip:region")
-    dp.callback_query.register(time_now, F.data == "time:now")
-    dp.callback_query.register(tasted_at_skip, F.data == "skip:tasted_at")
-    dp.callback_query.register(gear_skip, F.data == "skip:gear")
+    return router
+
+
+def photos_router() -> Router:
+    router = Router(name="photos")
+    router.message.filter(F.photo)
+    router.message.register(photo_add, StateFilter("*"))
+    return router
+
+
+def search_router() -> Router:
+    router = Router(name="search")
+    router.message.filter(StateFilter(SearchFlow))
+    router.message.register(s_name_run, SearchFlow.name)
+    router.message.register(s_cat_text, SearchFlow.category)
+    router.message.register(s_year_run, SearchFlow.year)
+    return router
 
-    dp.callback_query.register(aroma_dry_toggle, F.data.startswith("ad:"))
-    dp.callback_query.register(aroma_warmed_toggle, F.data.startswith("aw:"))
 
-    dp.callback_query.register(color_skip, F.data == "skip:color")
-    dp.callback_query.register(taste_toggle, F.data.startswith("taste:"))
-    dp.callback_query.register(special_skip, F.data == "skip:special")
-    dp.callback_query.register(inf_body_pick, F.data.startswith("body:"))
-    dp.callback_query.register(aftertaste_toggle, F.data.startswith("aft:"))
+def edit_router() -> Router:
+    router = Router(name="edit")
+    router.message.register(edit_flow_msg, EditFlow.waiting_text)
+    return router
 
-    dp.callback_query.register(more_infusions, F.data == "more_inf")
-    dp.callback_query.register(finish_infusions, F.data == "finish_inf")
 
-    dp.callback_query.register(eff_toggle_or_done, F.data.startswith("eff:"))
-    dp.callback_query.register(scn_toggle_or_done, F.data.startswith("scn:"))
+def menu_router() -> Router:
+    """Reply-кнопки и все остальные callback'и — последними."""
+    router = Router(name="menu")
+    router.message.register(
+        reply_buttons_router,
+        F.text,
+        lambda m: not (m.text or "").startswith("/"),
+        ~CommandStart(),
+    )
+    # один хендлер с поиском по таблицам CALLBACK_EXACT/CALLBACK_PREFIX
+    router.callback_query.register(route_callback, callback_route)
+    return router
 
-    dp.callback_query.register(rate_pick, F.data.startswith("rate:"))
-    dp.callback_query.register(summary_skip, F.data == "skip:summary")
 
-    dp.callback_query.register(photos_done, F.data == "photos:done")
-    dp.callback_query.register(photos_skip, F.data == "skip:photos")
-    dp.callback_query.register(show_pics, F.data.startswith("pics:"))
+def setup_handlers(dp: Dispatcher):
+    # повторные state.get_data() в пределах апдейта — из памяти
+    dp.message.outer_middleware(FSMCacheMiddleware())
+    dp.callback_query.outer_middleware(FSMCacheMiddleware())
 
-    # поиск / меню / пагинация
-    dp.callback_query.register(s_last, F.data == "s_last")
-    dp.callback_query.register(s_name, F.data == "s_name")
-    dp.callback_query.register(s_cat, F.data == "s_cat")
-    dp.callback_query.register(s_year, F.data == "s_year")
-    dp.callback_query.register(s_rating, F.data == "s_rating")
+    if DIAGNOSTICS_ENABLED:
+        dp.include_router(create_router(ADMINS, IS_PROD))
 
-    dp.callback_query.register(rating_filter_pick, F.data.startswith("frate:"))
-    dp.callback_query.register(more_last, F.data.startswith("more:last:"))
-    dp.callback_query.register(more_name, F.data.startswith("more:name:"))
-    dp.callback_query.register(more_cat, F.data.startswith("more:cat:"))
-    dp.callback_query.register(more_year, F.data.startswith("more:year:"))
-    dp.callback_query.register(more_rating, F.data.startswith("more:rating:"))
+    # порядок важен: команды, затем STATE-хендлеры, reply-кнопки в самом конце
+    dp.include_routers(
+        commands_router(),
+        new_tasting_router(),
+        photos_router(),
+        search_router(),
+        edit_router(),
+        menu_router(),
+    )
 
-    # редактирование tasting
-    dp.callback_query.register(edit_field_select, F.data.startswith("efld:"))
-    dp.callback_query.register(edit_category_pick, F.data.startswith("ecat:"))
-    dp.callback_query.register(edit_rating_pick, F.data.startswith("erat:"))
-    dp.callback_query.register(edit_cb, F.data.startswith("edit:"))
 
-    # карточка
-    dp.callback_query.register(open_card, F.data.startswith("open:"))
-    dp.callback_query.register(del_cb, F.data.startswith("del:"))
-    dp.callback_query.register(del_ok_cb, F.data.startswith("delok:"))
-    dp.callback_query.register(del_no_cb, F.data.startswith("delno:"))
+BOT_COMMANDS: Tuple[BotCommand, ...] = (
+    BotCommand(command="start", description="Главное меню"),
+    BotCommand(command="help", description="Помощь"),
+    BotCommand(command="new", description="Новая дегустация"),
+    BotCommand(command="find", description="Поиск"),
+    BotCommand(command="tz", description="Часовой пояс (UTC-сдвиг)"),
+    BotCommand(command="cancel", description="Отмена шага"),
+)
 
 
 async def set_bot_commands(bot: Bot):
-    commands = [
-        BotCommand(command="start", description="Главное меню"),
-        BotCommand(command="help", description="Помощь"),
-        BotCommand(command="new", description="Новая дегустация"),
-        BotCommand(command="find", description="Поиск"),
-        BotCommand(command="tz", description="Часовой пояс (UTC-сдвиг)"),
-        BotCommand(command="cancel", description="Отмена шага"),
-    ]
-    await bot.set_my_commands(commands)
+    await bot.set_my_commands(list(BOT_COMMANDS))
 
 
 # ---------------- MAIN ----------------
 
-async def main():
-    db_url = get_db_url()
-    try:
-        safe = db_url.render_as_string(hide_password=True)
-    except AttributeError:
-        safe = str(db_url)
-    print(f"[DB] Using: {safe}")
-    engine = create_sa_engine(db_url)
-    startup_ping(engine)
+BOT_HTTP_POOL_LIMIT = 100
 
+
+def _fsm_storage() -> BaseStorage:
+    """Redis (msgpack) при заданном REDIS_URL, иначе память процесса."""
+    url = get_redis_url()
+    if not url:
+        return MemoryStorage()
     try:
-        import uvloop  # type: ignore
+        import msgpack  # type: ignore
+        from aiogram.fsm.storage.redis import DefaultKeyBuilder, RedisStorage
+    except ImportError:
+        logger.warning("REDIS_URL is set but redis/msgpack are not installed; using memory")
+        return MemoryStorage()
 
-        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
-    except Exception:
+    # в FSM лежат байты фото — JSON их не умеет, msgpack умеет. RedisStorage
+    # декодирует значение как UTF-8, поэтому бинарь заворачиваем в base85.
+    def dumps(data) -> str:
+        return base64.b85encode(msgpack.packb(data, use_bin_type=True)).decode("ascii")
+
+    def loads(raw: str):
+        return msgpack.unpackb(base64.b85decode(raw), raw=False)
+
+    return RedisStorage.from_url(
+        url,
+        key_builder=DefaultKeyBuilder(with_bot_id=True),
+        json_dumps=dumps,
+        json_loads=loads,
+    )
+
+
+def _bot_session() -> AiohttpSession:
+    """HTTP-сессия бота; orjson для (де)сериализации, если установлен."""
+    kwargs = {}
+    try:
+        import orjson  # type: ignore
+    except ImportError:
         pass
+    else:
+        kwargs = {
+            "json_loads": orjson.loads,
+            "json_dumps": lambda obj: orjson.dumps(obj).decode(),
+        }
+    return AiohttpSession(limit=BOT_HTTP_POOL_LIMIT, **kwargs)
+
+
+def install_uvloop() -> None:
+    """Ставит политику uvloop; вызывать до asyncio.run, иначе цикл уже создан."""
+    try:
+        import uvloop  # type: ignore
+    except ImportError:
+        logger.warning("uvloop is not installed; using the default asyncio loop")
+        return
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
 
-    bot = Bot(get_bot_token())
 
+async def _drop_webhook(bot: Bot) -> None:
+    # обычно вебхука нет: один getWebhookInfo, и накопившиеся апдейты
+    # не теряются при каждом перезапуске
+    drop_pending = get_drop_pending_updates()
     try:
-        await bot.delete_webhook(drop_pending_updates=True)
+        if drop_pending or (await bot.get_webhook_info()).url:
+            await bot.delete_webhook(drop_pending_updates=drop_pending)
     except Exception:
         pass
 
-    dp = Dispatcher()
+
+async def main():
+    db_url = get_db_url()
+    logger.info("[DB] Using: %s", get_safe_db_url())
+    async_engine = create_async_sa_engine(db_url)
+
+    bot = Bot(get_bot_token(), session=_bot_session())
+
+    # апдейты идут задачами (handle_as_tasks), поэтому апдейты одного чата
+    # сериализуем замком по ключу FSM, а разные чаты обрабатываются параллельно
+    dp = Dispatcher(storage=_fsm_storage(), events_isolation=SimpleEventIsolation())
     setup_handlers(dp)
-    await set_bot_commands(bot)
+    # список считаем один раз по готовому дереву роутеров: Telegram шлёт
+    # только те типы апдейтов, на которые есть хендлеры
+    allowed_updates = dp.resolve_used_update_types()
+    logger.info("Allowed updates: %s", ", ".join(allowed_updates))
+    # прогрев БД идёт параллельно с запросами к Bot API
+    await asyncio.gather(
+        startup_ping(async_engine),
+        _drop_webhook(bot),
+        set_bot_commands(bot),
+    )
+
+    sweeper = asyncio.create_task(_album_sweeper())
+    logger.info("Start polling")
+    try:
+        await dp.start_polling(
+            bot,
+            allowed_updates=allowed_updates,
+            # длинный long-poll и параллельная обработка апдейтов из пачки
+            polling_timeout=50,
+            handle_as_tasks=True,
+            handle_signals=True,
+        )
+    finally:
+        sweeper.cancel()
 
-    logging.info("Start polling")
-    await dp.start_polling(
-        bot,
-        allowed_updates=dp.resolve_used_update_types(),
-        polling_timeout=30,
-        handle_signals=True,
-    )
+
+def run() -> None:
+    """Общая точка входа: uvloop, логи через фоновый поток, polling."""
+    install_uvloop()
+    log_listener = start_log_listener()
+    try:
+        asyncio.run(main())
+    finally:
+        log_listener.stop()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    run()
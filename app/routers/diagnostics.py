@@ -1,47 +1,65 @@
+import asyncio
+
 from aiogram import Router, types
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject
 from aiogram.filters.state import StateFilter
-from sqlalchemy import create_engine, text
+from sqlalchemy import text
 
-from app.config import get_db_url, get_media_backend, get_s3_config
-from app.filters.admin_only import AdminOnly
+from app.config import get_media_backend, get_s3_config, get_safe_db_url
+from app.db.engine import get_async_engine
 from app.services.storage import _s3_client
 
-def create_router(admin_ids: set[int], is_prod: bool) -> Router:
+# запрос /health собирается один раз и переиспользует скомпилированную форму
+_HEALTH_SQL = text("select current_database(), (select count(*) from tastings)")
+
+
+def _s3_ping(bucket: str) -> None:
+    _s3_client().list_objects_v2(Bucket=bucket, MaxKeys=1)
+
+
+def create_router(admin_ids: frozenset[int], is_prod: bool) -> Router:
     """Создаёт и настраивает диагностический роутер."""
     router = Router(name="diagnostics")
 
     if is_prod and not admin_ids:
         return router
 
-    @router.message(StateFilter("*"), Command("whoami"))
     async def whoami(message: types.Message):
         uid = int(message.from_user.id) if message.from_user else 0
-        await message.answer(f"you_id={uid}\\nis_admin={uid in admin_ids}")
+        await message.answer(f"you_id={uid}\nis_admin={uid in admin_ids}")
 
-    @router.message(StateFilter("*"), AdminOnly(admin_ids), Command("dbinfo"))
     async def dbinfo(message: types.Message):
-        url = get_db_url()
-        try:
-            safe = url.render_as_string(hide_password=True)
-        except AttributeError:
-            safe = str(url)
-        await message.answer(f"DB URL: {safe}")
-
-    @router.message(StateFilter("*"), AdminOnly(admin_ids), Command("health"))
+        await message.answer(f"DB URL: {get_safe_db_url()}")
+
     async def health(message: types.Message):
-        engine = create_engine(get_db_url(), future=True)
-        with engine.connect() as connection:
-            db = connection.execute(text("select current_database()")).scalar()
-            cnt = connection.execute(text("select count(*) from tastings")).scalar()
+        # пул общего async-движка бота, без блокировки event loop
+        async with get_async_engine().connect() as connection:
+            db, cnt = (await connection.execute(_HEALTH_SQL)).one()
         s3_status = "disabled"
         if get_media_backend() == "s3":
             cfg = get_s3_config()
             try:
-                _s3_client().list_objects_v2(Bucket=cfg.bucket, MaxKeys=1)
+                # создание клиента boto3 и запрос — блокирующие, уводим в поток
+                await asyncio.to_thread(_s3_ping, cfg.bucket)
                 s3_status = "ok"
             except Exception as exc:
                 s3_status = f"error:{type(exc).__name__}"
-        await message.answer(f"db={db}\\ncount(tastings)={cnt}\\ns3={s3_status}")
+        await message.answer(f"db={db}\ncount(tastings)={cnt}\ns3={s3_status}")
+
+    # команда -> (обработчик, только для админов); один хендлер и один фильтр
+    commands = {
+        "whoami": (whoami, False),
+        "dbinfo": (dbinfo, True),
+        "health": (health, True),
+    }
+
+    @router.message(StateFilter("*"), Command(*commands))
+    async def diagnostics(message: types.Message, command: CommandObject):
+        handler, admin_only = commands[command.command]
+        if admin_only:
+            uid = message.from_user.id if message.from_user else None
+            if uid not in admin_ids:
+                return
+        await handler(message)
 
     return router
@@ -2,113 +2,147 @@
 
 from __future__ import annotations
 
+import asyncio
 from typing import Any, Sequence
 
-from sqlalchemy import select
-from sqlalchemy.exc import IntegrityError
+from sqlalchemy import func, insert, select, update
 
-from app.db.engine import SessionLocal
-from app.db.models import Infusion, Photo, Tasting
+from app.db.engine import AsyncSessionLocal, upsert_insert
+from app.db.models import Infusion, Photo, Tasting, UserSeq
 from app.services.storage import save_photo_bytes
 
-_MAX_CREATE_ATTEMPTS = 2
+_MAX_SEQ_ATTEMPTS = 3
 
 
-def _next_seq_for_user(session, user_id: int) -> int:
-    stmt = (
-        select(Tasting.seq_no)
-        .where(Tasting.user_id == user_id)
-        .order_by(Tasting.seq_no.desc())
-        .limit(1)
-    )
-    bind = session.bind
-    if bind is not None and bind.dialect.name != "sqlite":
-        stmt = stmt.with_for_update()
-    last_seq = session.execute(stmt).scalar_one_or_none()
-    return (last_seq or 0) + 1
+async def _next_seq_for_user(session, user_id: int) -> int:
+    """Атомарно выдаёт следующий номер: один upsert ... RETURNING вместо max()+1."""
+    stmt = upsert_insert(session.bind)(UserSeq).values(user_id=user_id, last_seq=1)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[UserSeq.user_id],
+        set_={"last_seq": UserSeq.last_seq + 1},
+    ).returning(UserSeq.last_seq)
+    return (await session.execute(stmt)).scalar_one()
 
 
-def create_tasting(
+async def _resync_seq_for_user(session, user_id: int) -> int:
+    """Счётчик отстал от tastings (старые записи): ставим его на max(seq_no)+1."""
+    max_seq = (
+        select(func.coalesce(func.max(Tasting.seq_no), 0) + 1)
+        .where(Tasting.user_id == user_id)
+        .scalar_subquery()
+    )
+    stmt = (
+        update(UserSeq)
+        .where(UserSeq.user_id == user_id)
+        .values(last_seq=max_seq)
+        .returning(UserSeq.last_seq)
+    )
+    return (await session.execute(stmt)).scalar_one()
+
+
+async def _insert_tasting(session, tasting_data: dict) -> Tasting:
+    """INSERT ... ON CONFLICT (user_id, seq_no) DO NOTHING RETURNING в одной транзакции.
+
+    Занятый номер не откатывает транзакцию: счётчик подтягивается и вставка
+    повторяется без новой сессии.
+    """
+    user_id = tasting_data["user_id"]
+    seq_no = await _next_seq_for_user(session, user_id)
+    for _ in range(_MAX_SEQ_ATTEMPTS):
+        stmt = (
+            upsert_insert(session.bind)(Tasting)
+            .values(seq_no=seq_no, **tasting_data)
+            .on_conflict_do_nothing(index_elements=[Tasting.user_id, Tasting.seq_no])
+            .returning(Tasting)
+        )
+        tasting = (await session.scalars(stmt)).one_or_none()
+        if tasting is not None:
+            return tasting
+        seq_no = await _resync_seq_for_user(session, user_id)
+    raise RuntimeError("Failed to allocate seq_no for tasting")
+
+
+async def create_tasting(
     tasting_data: dict,
     infusions: Sequence[dict],
     photos: Sequence[Any],
 ) -> Tasting:
     """Создаёт дегустацию вместе с проливами и фото."""
 
-    attempts = 0
-    while attempts < _MAX_CREATE_ATTEMPTS:
-        attempts += 1
-        with SessionLocal() as session:
-            try:
-                with session.begin():
-                    seq_no = _next_seq_for_user(session, tasting_data["user_id"])
-                    tasting = Tasting(seq_no=seq_no, **tasting_data)
-                    session.add(tasting)
-                    session.flush()
-
-                    for infusion in infusions:
-                        session.add(
-                            Infusion(
-                                tasting_id=tasting.id,
-                                n=infusion.get("n"),
-                                seconds=infusion.get("seconds"),
-                                liquor_color=infusion.get("liquor_color"),
-                                taste=infusion.get("taste"),
-                                special_notes=infusion.get("special_notes"),
-                                body=infusion.get("body"),
-                                aftertaste=infusion.get("aftertaste"),
-                            )
-                        )
-
-                    for photo_entry in photos:
-                        if isinstance(photo_entry, str):
-                            session.add(
-                                Photo(
-                                    tasting_id=tasting.id,
-                                    file_id=photo_entry,
-                                    storage_backend="local",
-                                    telegram_file_id=photo_entry,
-                                )
-                            )
-                            continue
-
-                        if not isinstance(photo_entry, dict):
-                            continue
-
-                        body = photo_entry.get("body")
-                        telegram_file_id = photo_entry.get("telegram_file_id")
-                        if body is None or telegram_file_id is None:
-                            continue
-
-                        filename_hint = (
-                            photo_entry.get("filename_hint")
-                            or photo_entry.get("filename")
-                            or "photo.jpg"
-                        )
-                        result = save_photo_bytes(
-                            tasting_data["user_id"],
-                            tasting.id,
-                            body,
-                            filename_hint=filename_hint,
-                        )
-                        session.add(
-                            Photo(
-                                tasting_id=tasting.id,
-                                file_id=telegram_file_id,
-                                storage_backend=result.storage_backend,
-                                object_key=result.object_key,
-                                content_type=result.content_type,
-                                size_bytes=result.size_bytes,
-                                telegram_file_id=telegram_file_id,
-                                telegram_file_unique_id=photo_entry.get(
-                                    "telegram_file_unique_id"
-                                ),
-                            )
-                        )
-
-                session.refresh(tasting)
-                return tasting
-            except IntegrityError:
-                if attempts >= _MAX_CREATE_ATTEMPTS:
-                    raise
-    raise RuntimeError("Failed to create tasting after retries")
+    async with AsyncSessionLocal() as session:
+        async with session.begin():
+            tasting = await _insert_tasting(session, tasting_data)
+
+            infusion_rows = [
+                {
+                    "tasting_id": tasting.id,
+                    "n": infusion.get("n"),
+                    "seconds": infusion.get("seconds"),
+                    "liquor_color": infusion.get("liquor_color"),
+                    "taste": infusion.get("taste"),
+                    "special_notes": infusion.get("special_notes"),
+                    "body": infusion.get("body"),
+                    "aftertaste": infusion.get("aftertaste"),
+                }
+                for infusion in infusions
+            ]
+            photo_rows = []
+            for photo_entry in photos:
+                if isinstance(photo_entry, str):
+                    photo_rows.append(
+                        {
+                            "tasting_id": tasting.id,
+                            "file_id": photo_entry,
+                            "storage_backend": "local",
+                            "object_key": None,
+                            "content_type": None,
+                            "size_bytes": None,
+                            "telegram_file_id": photo_entry,
+                            "telegram_file_unique_id": None,
+                        }
+                    )
+                    continue
+
+                if not isinstance(photo_entry, dict):
+                    continue
+
+                body = photo_entry.get("body")
+                telegram_file_id = photo_entry.get("telegram_file_id")
+                if body is None or telegram_file_id is None:
+                    continue
+
+                filename_hint = (
+                    photo_entry.get("filename_hint")
+                    or photo_entry.get("filename")
+                    or "photo.jpg"
+                )
+                # запись файла или PUT в S3 блокирует — уводим в поток
+                result = await asyncio.to_thread(
+                    save_photo_bytes,
+                    tasting_data["user_id"],
+                    tasting.id,
+                    body,
+                    filename_hint=filename_hint,
+                )
+                photo_rows.append(
+                    {
+                        "tasting_id": tasting.id,
+                        "file_id": telegram_file_id,
+                        "storage_backend": result.storage_backend,
+                        "object_key": result.object_key,
+                        "content_type": result.content_type,
+                        "size_bytes": result.size_bytes,
+                        "telegram_file_id": telegram_file_id,
+                        "telegram_file_unique_id": photo_entry.get(
+                            "telegram_file_unique_id"
+                        ),
+                    }
+                )
+
+            # по одному executemany на таблицу вместо INSERT на строку
+            if infusion_rows:
+                await session.execute(insert(Infusion), infusion_rows)
+            if photo_rows:
+                await session.execute(insert(Photo), photo_rows)
+
+    return tasting
@@ -4,10 +4,16 @@ from __future__ import annotations
 
 from typing import Optional
 
-from app.db.engine import SessionLocal
+from cachetools import TTLCache
+
+from app.db.engine import AsyncSessionLocal, upsert_insert
 from app.db.models import User
 
 
+# uid -> tz_offset_min; сдвиг меняется редко, а нужен на каждом «текущем времени»
+_TZ_CACHE: "TTLCache[int, int]" = TTLCache(maxsize=10_000, ttl=600)
+
+
 def _normalize_username(username: Optional[str]) -> Optional[str]:
     if not username:
         return None
@@ -17,37 +23,64 @@ def _normalize_username(username: Optional[str]) -> Optional[str]:
     return cleaned[:32]
 
 
-def get_or_create_user(user_id: int, username: Optional[str] = None) -> User:
+async def get_or_create_user(
+    user_id: int, username: Optional[str] = None
+) -> User:
     """Гарантирует наличие записи о пользователе и возвращает её."""
 
     normalized_username = _normalize_username(username)
 
-    with SessionLocal() as session:
-        user = session.get(User, user_id)
+    async with AsyncSessionLocal() as session:
+        # запись только при вставке или смене username; иначе RETURNING пуст
+        # и строку читаем обычным SELECT без блокировки
+        stmt = upsert_insert(session.bind)(User).values(
+            id=user_id, username=normalized_username
+        )
+        if normalized_username is not None:
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[User.id],
+                set_={"username": stmt.excluded.username},
+                where=User.username.is_distinct_from(stmt.excluded.username),
+            )
+        else:
+            stmt = stmt.on_conflict_do_nothing(index_elements=[User.id])
+        user = (
+            await session.execute(
+                stmt.returning(User), execution_options={"populate_existing": True}
+            )
+        ).scalar_one_or_none()
         if user is None:
-            user = User(id=user_id, username=normalized_username)
-            session.add(user)
-            session.commit()
-            session.refresh(user)
-            return user
-
-        if normalized_username is not None and user.username != normalized_username:
-            user.username = normalized_username
-            session.commit()
-            session.refresh(user)
+            user = await session.get(User, user_id)
+        await session.commit()
         return user
 
 
-def set_user_timezone(user_id: int, offset_min: int) -> User:
+async def get_user_tz_offset(user_id: int) -> int:
+    """Сдвиг пояса пользователя в минутах; из кэша, при промахе — из БД."""
+
+    offset = _TZ_CACHE.get(user_id)
+    if offset is None:
+        user = await get_or_create_user(user_id)
+        offset = _TZ_CACHE[user_id] = user.tz_offset_min or 0
+    return offset
+
+
+async def set_user_timezone(user_id: int, offset_min: int) -> User:
     """Сохраняет часовой пояс пользователя, создавая запись при необходимости."""
 
-    with SessionLocal() as session:
-        user = session.get(User, user_id)
-        if user is None:
-            user = User(id=user_id, tz_offset_min=offset_min)
-            session.add(user)
-        else:
-            user.tz_offset_min = offset_min
-        session.commit()
-        session.refresh(user)
-        return user
+    async with AsyncSessionLocal() as session:
+        stmt = upsert_insert(session.bind)(User).values(
+            id=user_id, tz_offset_min=offset_min
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[User.id],
+            set_={"tz_offset_min": stmt.excluded.tz_offset_min},
+        ).returning(User)
+        user = (
+            await session.execute(
+                stmt, execution_options={"populate_existing": True}
+            )
+        ).scalar_one()
+        await session.commit()
+    _TZ_CACHE[user_id] = offset_min
+    return user
@@ -1,11 +1,14 @@
 """Inline keyboard helpers."""
 
+from functools import lru_cache
+
 from aiogram.types import InlineKeyboardMarkup
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
 
+@lru_cache(maxsize=32)
 def skip_inline_kb(tag: str) -> InlineKeyboardMarkup:
-    """Build inline keyboard with a single "Skip" button."""
+    """Build inline keyboard with a single "Skip" button (cached per tag)."""
     kb = InlineKeyboardBuilder()
     kb.button(text="Пропустить", callback_data=f"skip:{tag}")
     kb.adjust(1)
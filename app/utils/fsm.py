@@ -0,0 +1,66 @@
+from copy import deepcopy
+from typing import Any, Awaitable, Callable, Dict, Mapping, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.fsm.context import FSMContext
+from aiogram.types import TelegramObject
+
+
+class CachedFSMContext(FSMContext):
+    """FSMContext, который отдаёт data из памяти после первого чтения за апдейт.
+
+    Хендлер и вызываемые им помощники (ask_next и т.п.) часто читают data
+    по нескольку раз; с Redis каждое чтение — отдельный запрос.
+    """
+
+    def __init__(self, context: FSMContext) -> None:
+        super().__init__(context.storage, context.key)
+        self._data: Optional[Dict[str, Any]] = None
+
+    async def _cached(self) -> Dict[str, Any]:
+        if self._data is None:
+            self._data = await super().get_data()
+        return self._data
+
+    async def get_data(self) -> Dict[str, Any]:
+        # копия: хендлеры меняют вложенные списки до update_data
+        return deepcopy(await self._cached())
+
+    async def get_value(self, key: str, default: Any = None) -> Any:
+        return deepcopy((await self._cached()).get(key, default))
+
+    def drop_cache(self) -> None:
+        self._data = None
+
+    async def set_data(self, data: Mapping[str, Any]) -> None:
+        await super().set_data(data)
+        self._data = deepcopy(dict(data))
+
+    async def update_data(
+        self, data: Optional[Mapping[str, Any]] = None, **kwargs: Any
+    ) -> Dict[str, Any]:
+        # запись идёт через storage.update_data — он перечитывает свежие данные,
+        # и параллельный апдейт того же чата (альбом фото) не затирается
+        merged = await super().update_data(data, **kwargs)
+        self._data = deepcopy(merged)
+        return merged
+
+
+class FSMCacheMiddleware(BaseMiddleware):
+    """Подменяет state на CachedFSMContext на время обработки апдейта."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        state = data.get("state")
+        if state is None or isinstance(state, CachedFSMContext):
+            return await handler(event, data)
+        cached = data["state"] = CachedFSMContext(state)
+        try:
+            return await handler(event, data)
+        finally:
+            # кэш живёт только в пределах апдейта, даже если контекст сохранили
+            cached.drop_cache()
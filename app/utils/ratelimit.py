@@ -0,0 +1,65 @@
+import asyncio
+import time
+from typing import Hashable
+
+from cachetools import LRUCache
+
+
+class TokenBucket:
+    """Ведро токенов: до capacity запросов подряд, дальше rate в секунду."""
+
+    __slots__ = ("tokens", "last", "cap", "rate")
+
+    def __init__(self, cap: float, rate: float, now: float) -> None:
+        self.tokens = cap
+        self.last = now
+        self.cap = cap
+        self.rate = rate
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.cap, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def take(self, now: float) -> bool:
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def reserve(self, now: float) -> float:
+        """Берёт токен в долг; возвращает, сколько секунд ждать до своей очереди."""
+        self._refill(now)
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class RateLimiter:
+    """Отдельное ведро на каждый ключ (обычно user_id).
+
+    Вёдер не больше max_keys: давно неактивные вытесняются первыми, а через
+    несколько секунд простоя ведро всё равно полное, как новое.
+    """
+
+    def __init__(self, capacity: float, rate: float, max_keys: int = 10_000) -> None:
+        self.capacity = capacity
+        self.rate = rate
+        self.buckets: "LRUCache[Hashable, TokenBucket]" = LRUCache(maxsize=max_keys)
+
+    def _bucket(self, key: Hashable, now: float) -> TokenBucket:
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = TokenBucket(self.capacity, self.rate, now)
+        return bucket
+
+    def allow(self, key: Hashable) -> bool:
+        """Пропустить сейчас или отказать (для действий пользователя)."""
+        now = time.monotonic()
+        return self._bucket(key, now).take(now)
+
+    async def acquire(self, key: Hashable) -> None:
+        """Дождаться своей очереди (для исходящих сообщений)."""
+        now = time.monotonic()
+        delay = self._bucket(key, now).reserve(now)
+        if delay > 0:
+            await asyncio.sleep(delay)
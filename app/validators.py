@@ -1,9 +1,15 @@
 from __future__ import annotations
 
 import re
-from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from decimal import Decimal, ROUND_HALF_UP
 from typing import Iterable, List
 
+# отсекаем заведомо нечисловой ввод до int()/Decimal(): без исключения на
+# мусоре и без экзотики, которую те принимают («1_000», «NaN», «1e3»)
+_INT_RE = re.compile(r"[+-]?[0-9]+")
+_DECIMAL_RE = re.compile(r"[+-]?(?:[0-9]+(?:\.[0-9]*)?|\.[0-9]+)")
+_LIST_SPLIT_RE = re.compile(r"[\s,;]+")
+
 
 def parse_int(
     raw: str,
@@ -13,10 +19,9 @@ def parse_int(
     error_message: str,
 ) -> int:
     text = (raw or "").strip()
-    try:
-        value = int(text)
-    except (TypeError, ValueError):
-        raise ValueError(error_message) from None
+    if not _INT_RE.fullmatch(text):
+        raise ValueError(error_message)
+    value = int(text)
 
     if value < min_value or value > max_value:
         raise ValueError(error_message)
@@ -33,13 +38,10 @@ def parse_float(
     precision: int = 1,
 ) -> float:
     text = (raw or "").strip().replace(",", ".")
-    if not text:
+    if not _DECIMAL_RE.fullmatch(text):
         raise ValueError(error_message)
 
-    try:
-        value = Decimal(text)
-    except (InvalidOperation, ValueError):
-        raise ValueError(error_message) from None
+    value = Decimal(text)
 
     quant = Decimal(10) ** -precision
     value = value.quantize(quant, rounding=ROUND_HALF_UP)
@@ -62,7 +64,7 @@ def parse_infusions_list(
     if not text:
         raise ValueError(error_message)
 
-    parts: Iterable[str] = re.split(r"[\s,;]+", text)
+    parts: Iterable[str] = _LIST_SPLIT_RE.split(text)
     values: List[int] = []
     for part in parts:
         if not part:
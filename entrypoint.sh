@@ -13,14 +13,9 @@ fi
 # 1) Печатаем ENV/DSN для явной диагностики
 echo "[ENTRYPOINT] ENV user=${POSTGRESQL_USER:-} host=${POSTGRESQL_HOST:-} db=${POSTGRESQL_DBNAME:-} sslmode=${POSTGRESQL_SSLMODE:-}"
 python - <<'PY'
-from app.config import get_db_url
+from app.config import get_safe_db_url
 
-url = get_db_url()
-try:
-    safe = url.render_as_string(hide_password=True)
-except AttributeError:
-    safe = str(url)
-print("[ENTRYPOINT] DSN:", safe)
+print("[ENTRYPOINT] DSN:", get_safe_db_url())
 PY
 
 # 2) Миграции (опционально)
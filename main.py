@@ -1,7 +1,5 @@
-import asyncio
-
-from app.main import main
+from app.main import run
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    run()